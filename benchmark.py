@@ -0,0 +1,164 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import pickle
+import tempfile
+from pathlib import Path
+import loading_text as lt
+import character as chr
+from metrics import StageMetrics
+from synthetic_save import generate_save, generate_localization, largest_house_member
+
+# Benchmark of the export pipeline on synthetic saves of growing size. Each size gets a working folder holding the
+# save, a config.ini and a localization cache, so loading_main runs the same code as for a real save.
+
+reported_stages = ('loading_main', 'char_main', 'char_main/family linking', 'char_main/localization',
+                   'char_main/to_csv')
+
+# Memory held by the exported characters is measured from the end of the first stage to the end of the second,
+# once the families are linked and just before the output is written
+held_stages = ('loading_main', 'char_main/add_parents_note')
+
+# Output files the exports can be compared on, by the name export_members picks the writer from
+output_names = {'csv': 'export.csv', 'csv.gz': 'export.csv.gz', 'gramps': 'export.gramps'}
+
+
+def prepare(workdir: Path, characters: int, dynasties: int, seed: int) -> tuple[Path, str]:
+
+    # Writes the save and what Load needs next to it, and returns the save path and the main ID to export
+    workdir.mkdir(parents=True, exist_ok=True)
+    data = generate_save(characters, dynasties, seed)
+    json_path = workdir / 'save.json'
+    json_path.write_text(json.dumps(data, separators=(',', ':')), encoding='utf-8')
+
+    # The game folder doesn't exist, so Load uses the cache as it is. Snapshots are off, so every run parses the save
+    (workdir / 'resources').mkdir(exist_ok=True)
+    with (workdir / 'resources' / 'loc_data_english.pickle').open('wb') as w:
+        pickle.dump({'fingerprint': None, 'data': generate_localization(data, seed)}, w)
+    (workdir / 'config.ini').write_text('[Default]\nck3 directory = ./no_game\ngame save directory =\n'
+                                        'ck3 resource directory = ./resources\nlanguage = english\n'
+                                        'snapshot cache mb = 0\n')
+    return json_path, largest_house_member(data)
+
+
+def run_once(workdir: Path, json_path: Path, main_id: str, trace_memory: bool, stream: bool,
+             output_format: str = 'csv') -> dict:
+    with contextlib.chdir(workdir), contextlib.redirect_stdout(io.StringIO()), \
+            StageMetrics(trace_memory=trace_memory) as metrics:
+        data, loc_data = lt.Load().loading_main(json_path, main_id if stream else None, metrics=metrics)
+        chr.char_main(data, loc_data, main_id, workdir / output_names[output_format], metrics=metrics)
+    return {record['stage']: record for record in metrics.stages}
+
+
+def scaling(previous: dict, current: dict, stage: str, count: str):
+
+    # Exponent of the growth from one size to the next: about 1 for linear work, 2 for quadratic
+    ratio = current[count] / previous[count]
+    if ratio <= 1 or not previous['seconds'][stage] or not current['seconds'][stage]:
+        return None
+    return math.log(current['seconds'][stage] / previous['seconds'][stage]) / math.log(ratio)
+
+
+def benchmark(sizes: list, repeat: int = 3, dynasties: int = 8, seed: int = 0, workdir: Path = None,
+              trace_memory: bool = False, stream: bool = False, formats: tuple = ('csv',)) -> list:
+
+    """Times the stages of loading_main and char_main for a synthetic save of every size, keeping the fastest of
+    repeat runs for each stage and the highest peak memory. The number of root dynasties stays the same across
+    sizes, so the exported dynasty grows along with the save. loading_main scales with the save, the rest of the
+    stages with the number of exported characters. The stages are those of the first output format, and every
+    format gets the time of char_main and the size of its file under outputs. With trace_memory, held_bytes is the
+    lowest memory the export held before writing its output, over what the loaded save takes."""
+
+    results = []
+    with contextlib.ExitStack() as stack:
+        workdir = Path(workdir or stack.enter_context(tempfile.TemporaryDirectory()))
+        for size in sizes:
+            size_dir = workdir / f'save_{size}'
+            json_path, main_id = prepare(size_dir, size, dynasties, seed)
+            outputs = {}
+            for output_format in formats:
+                format_runs = [run_once(size_dir, json_path, main_id, trace_memory, stream, output_format)
+                               for _ in range(repeat)]
+                outputs[output_format] = {
+                    'seconds': min(run['char_main']['seconds'] for run in format_runs),
+                    'bytes': (size_dir / output_names[output_format]).stat().st_size,
+                }
+                if output_format == formats[0]:
+                    runs = format_runs
+            stages = [stage for stage in reported_stages if stage in runs[0]]
+            results.append({
+                'characters': size,
+                'save_characters': runs[0]['loading_main/save']['records'],
+                'exported': runs[0]['char_main/localization']['records'],
+                'main_id': main_id,
+                'seconds': {stage: min(run[stage]['seconds'] for run in runs) for stage in stages},
+                'peak_bytes': {stage: max(run[stage]['peak_bytes'] or 0 for run in runs) for stage in stages}
+                if trace_memory else None,
+                'held_bytes': min(run[held_stages[1]]['held_bytes'] - run[held_stages[0]]['held_bytes']
+                                  for run in runs) if trace_memory else None,
+                'outputs': outputs,
+            })
+    return results
+
+
+def print_results(results: list):
+    short = [stage.split('/')[-1] for stage in reported_stages]
+    print(f'{"characters":>10} {"exported":>9} ' + ' '.join(f'{name:>15}' for name in short))
+    for index, result in enumerate(results):
+        cells = []
+        for stage in reported_stages:
+            seconds = result['seconds'].get(stage)
+            cell = '-' if seconds is None else f'{seconds:.3f}s'
+            if index and seconds is not None:
+                count = 'save_characters' if stage == 'loading_main' else 'exported'
+                exponent = scaling(results[index - 1], result, stage, count)
+                cell += f' ^{exponent:.2f}' if exponent is not None else ''
+            cells.append(f'{cell:>15}')
+        print(f'{result["save_characters"]:>10} {result["exported"]:>9} ' + ' '.join(cells))
+    print('^ is the scaling exponent from the previous size: about 1 is linear, 2 is quadratic')
+
+    if results and results[0]['held_bytes'] is not None:
+        print(f'\n{"exported":>10} {"held":>12} {"per character":>14}')
+        for result in results:
+            print(f'{result["exported"]:>10} {result["held_bytes"] / 2 ** 20:>9.1f} MB '
+                  f'{result["held_bytes"] / max(result["exported"], 1):>12.0f} B')
+        print('Memory held by the export once the families are linked, before the output is written')
+
+    formats = list(results[0]['outputs']) if results else []
+    if len(formats) > 1:
+        print(f'\n{"exported":>10} ' + ' '.join(f'{output_format:>22}' for output_format in formats))
+        for result in results:
+            cells = [f'{output["seconds"]:.3f}s {output["bytes"] / 2 ** 20:.2f} MB'
+                     for output in result['outputs'].values()]
+            print(f'{result["exported"]:>10} ' + ' '.join(f'{cell:>22}' for cell in cells))
+        print('char_main time and file size of every output format')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times the export pipeline on synthetic saves of growing size.')
+    parser.add_argument('sizes', nargs='*', type=int, default=[1000, 10000, 100000],
+                        help='characters in each generated save')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per size, the fastest is kept')
+    parser.add_argument('-d', '--dynasties', type=int, default=8, help='root dynasties in every save')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='keep the generated saves and exports in this folder')
+    parser.add_argument('--memory', action='store_true',
+                        help='also record peak memory and the memory held per exported character, which slows the '
+                             'runs')
+    parser.add_argument('--stream', action='store_true', help='load the save with the streaming loader')
+    parser.add_argument('-f', '--formats', nargs='+', choices=list(output_names), default=['csv'],
+                        help='output formats to export and compare, the stages are timed on the first')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.sizes, args.repeat, args.dynasties, args.seed, args.workdir, args.memory, args.stream,
+                        tuple(args.formats))
+    print_results(results)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
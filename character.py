@@ -1,43 +1,60 @@
 
 from house_cleaning import safe_get, safe_get_multiple,combine_values
+from save_store import SaveStore
+from progress import CancelToken
+from metrics import StageMetrics
+from gramps_xml import GrampsWriter
+from snapshot_cache import gc_paused
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from operator import attrgetter
 from pathlib import Path
+import contextlib
+import heapq
+import pickle
+import gzip
+import sys
 import csv
+import io
 
 
-class Character():
+# Write buffer of the output files, large enough that the rows streamed during localization rarely reach the disk alone
+csv_buffer_size = 1 << 20
+
 
-    # List of characters
-    non_dyn_children = set()
-    non_dyn_spouse = set()
-    all_id_num = set()
+def intern(value):
 
-    # Dicts to organize individual into families
-    child_to_parents = {}
-    families = {}
-    family_counter = 1
+    # Dates, causes of death and sexualities repeat across thousands of characters, so one copy of each is kept
+    return sys.intern(value) if isinstance(value, str) else value
 
-    # Processed data prepared to write to csv file
-    marriage_to_csv =[]
-    families_to_csv = []
-    person_to_csv = []
+
+class Character():
+
+    # Attributes are kept in slots instead of a __dict__, since every exported character stays alive until the
+    # csv is written. The note and csv row are only rendered then
+    __slots__ = ('id_num', 'first_name', 'dynasty_house', 'birth', 'death_data', 'death_reason', 'skill', 'traits',
+                 'recessive_traits', 'faith', 'culture', 'sex', 'orientation', 'titles', 'spouse')
 
     skill_names = ('DIP', 'STE', 'MAR', 'INT', 'LEA', 'PRO')
+    spouse_keys = ('spouse', 'former_spouses', 'concubinist', 'former_concubinists')
 
-    def __init__(self,id_num: str, person: dict, data: dict, dyn_flag =True, non_dyn_spouse =False):
+    def __init__(self,id_num: str, person: dict, session: 'ExportSession', dyn_flag =True, non_dyn_spouse =False):
 
         """Putting all person and family data into Character object. Custom functions safe_get,safe_get_multiple,
-        combine_values, used to parse through variable formats that some information comes through"""
+        combine_values, used to parse through variable formats that some information comes through. The family
+        links go into the session of the export, whose resolver provides the house head used when faith or culture
+        is missing"""
 
         # Personal Information
         self.id_num = id_num
-        if non_dyn_spouse is False: Character.all_id_num.add(self.id_num)
+        if non_dyn_spouse is False: session.all_id_num.add(self.id_num)
         self.first_name = person.get('first_name')
         self.dynasty_house = person.get ('dynasty_house')
-        self.birth = person.get('birth')
-        self.death_data = safe_get(person, 'dead_data', 'date')
-        self.death_reason = safe_get(person, 'dead_data', 'reason')
+        self.birth = intern(person.get('birth'))
+        self.death_data = intern(safe_get(person, 'dead_data', 'date'))
+        self.death_reason = intern(safe_get(person, 'dead_data', 'reason'))
 
-        self.skill = [f"{s} {v}" for s, v in zip(Character.skill_names, person.get('skill'))]
+        self.skill = tuple(person.get('skill'))
         self.traits = person.get('traits')
         self.recessive_traits = person.get('recessive_traits')
 
@@ -45,148 +62,81 @@ class Character():
         self.faith = person.get('faith')
         self.culture = person.get('culture')
         if self.faith is None:
-            house_head = safe_get(data['dynasties'][str(self.dynasty_house)])['head_of_house']
-            self.faith= data['characters'][str(house_head)]['faith']
+            self.faith = session.resolver.house_head(self.dynasty_house)['faith']
         if self.culture is None:
-            house_head = safe_get(data['dynasties'][str(self.dynasty_house)])['head_of_house']
-            self.culture = data['characters'][str(house_head)]['culture']
+            self.culture = session.resolver.house_head(self.dynasty_house)['culture']
 
         self.sex = 'Female' if person.get('female') else 'Male'
-        self.orientation = person.get('sexuality', 'he')
+        self.orientation = intern(person.get('sexuality', 'he'))
         self.titles = safe_get(person, 'landed_data', 'domain') or safe_get(person, 'dead_data', 'domain')
 
         # Family Information only for dynasty members
 
-        self.children = safe_get(person, 'family_data', 'child')
+        children = safe_get(person, 'family_data', 'child')
 
         # Loop to link children to parent pair using a parent to iterate from
-        if self.children is not None and dyn_flag is True:
-            for child in self.children:
-                if str(child) not in Character.child_to_parents:
-                    Character.child_to_parents[str(child)] = {"husband": None, "wife": None}
-                if self.sex == 'Female':
-                    Character.child_to_parents[str(child)]['wife'] = self.id_num
-                elif self.sex == 'Male':
-                    Character.child_to_parents[str(child)]['husband'] = self.id_num
+        if children is not None and dyn_flag is True:
+            for child in children:
+                if str(child) not in session.child_to_parents:
+                    session.child_to_parents[str(child)] = {"husband": None, "wife": None}
+                    session.count_parent_pair((None, None), 1)
+                self.link_child(str(child), session)
 
-        elif non_dyn_spouse is True and self.children is not None:
-            for child in self.children:
-                if str(child) in Character.all_id_num:
+        elif non_dyn_spouse is True and children is not None:
+            for child in children:
+                if str(child) in session.all_id_num:
+                    self.link_child(str(child), session)
 
-                    if self.sex == 'Female':
-                        Character.child_to_parents[str(child)]['wife'] = self.id_num
-
-                    elif self.sex == 'Male':
-                        Character.child_to_parents[str(child)]['husband'] = self.id_num
-
-        spouse_keys = ['spouse', 'former_spouses', 'concubinist', 'former_concubinists']
-        self.spouse = set(combine_values(*safe_get_multiple(person, 'family_data', *spouse_keys)))
+        # The set is only needed to update non_dyn_spouse, the character keeps a tuple in the same order
+        spouses = set(combine_values(*safe_get_multiple(person, 'family_data', *Character.spouse_keys)))
+        self.spouse = tuple(spouses)
 
 
         if non_dyn_spouse is True and self.spouse is not None:
-            self.spouse_no_kids()
+            self.spouse_no_kids(session)
 
         # Joining non_dynasty members to later loop
         if dyn_flag is True:
-            Character.non_dyn_spouse.update(self.spouse or [])
-           # if self.unwed is not None: Character.non_dyn_spouse.add(self.unwed)
-            Character.non_dyn_children.update(self.children or [])
-
+            session.non_dyn_spouse.update(spouses or [])
+           # if self.unwed is not None: session.non_dyn_spouse.add(self.unwed)
+            session.non_dyn_children.update(children or [])
 
-    @classmethod
-    def add_non_dynasty(cls, data: dict) -> list:
-        cls.non_dyn_children = {str(member) for member in cls.non_dyn_children} - cls.all_id_num
-        cls.non_dyn_spouse = {str(member) for member in cls.non_dyn_spouse} - cls.all_id_num
-        cls.non_dyn_children = cls.non_dyn_children - cls.non_dyn_spouse
-
-        non_members = []
-        for non_member in cls.non_dyn_children:
-            try:
-                character = Character(non_member, data['characters'][non_member], data,dyn_flag=False)
-                non_members.append(character)
-            except KeyError:
-                print(f'Character ID {non_member} is skipped')
-                continue
-        for non_member in cls.non_dyn_spouse:
-            try:
-                character = Character(non_member, data['characters'][non_member], data,dyn_flag=False, non_dyn_spouse= True)
-                non_members.append(character)
-            except KeyError:
-                print(f'Character ID {non_member} is skipped')
-                continue
+    def link_child(self, child: str, session: 'ExportSession'):
 
+        # Sets this character as a parent of child. Raises KeyError if the child has no parent entry yet
+        parents = session.child_to_parents[child]
+        session.count_parent_pair((parents['husband'], parents['wife']), -1)
+        if self.sex == 'Female':
+            parents['wife'] = self.id_num
+        elif self.sex == 'Male':
+            parents['husband'] = self.id_num
+        session.count_parent_pair((parents['husband'], parents['wife']), 1)
 
-        return non_members
-    def spouse_no_kids(self):
+    def spouse_no_kids(self, session: 'ExportSession'):
 
         for spouse in self.spouse:
 
-            if str(spouse) in Character.all_id_num:
+            if str(spouse) in session.all_id_num:
 
-                if (self.sex == 'Female' and {"husband": str(spouse), "wife": self.id_num}
-                        not in Character.child_to_parents.values() and [str(spouse), self.id_num]
-                        not in Character.marriage_to_csv):
-                    Character.marriage_to_csv.append([str(spouse), self.id_num])
-
-                elif (self.sex == 'Male' and {"husband": self.id_num, "wife": str(spouse)}
-                      not in Character.child_to_parents.values() and [self.id_num, str(spouse)]
-                        not in Character.marriage_to_csv):
-                    Character.marriage_to_csv.append([self.id_num, str(spouse)])
-
-    @classmethod
-    def add_marriage_id(cls):
-        for marriage in cls.marriage_to_csv:
-            marriage.insert(0,f'm{cls.family_counter}')
-            cls.family_counter += 1
-        return
-
-    @classmethod
-    def add_parents_note(cls):
-
-        # Match spouse pairs with children. Prepping the marriage and family rows for csv
-        for child, parents in cls.child_to_parents.items():
-            parent_pair = f'{parents['husband']} {parents['wife']}'
-
-            if parent_pair not in cls.families:
-                marriage_id = f"m{cls.family_counter}"
-                cls.families[parent_pair] = {
-                    "marriage": marriage_id,
-                    "husband": parents['husband'],
-                    "wife": parents['wife'],
-                    "child": []
-                }
-                cls.family_counter += 1
-            cls.families[parent_pair]["child"].append(child)
+                if self.sex == 'Female':
+                    pair = (str(spouse), self.id_num)
+                elif self.sex == 'Male':
+                    pair = (self.id_num, str(spouse))
 
-        for parents, family_info in cls.families.items():
-            cls.marriage_to_csv.append([family_info['marriage'],family_info['husband'],family_info['wife']])
-            for child in family_info['child']:
-                cls.families_to_csv.append([family_info['marriage'], child])
+                if pair not in session.parent_pairs and pair not in session.marriage_pairs:
+                    session.marriage_pairs.add(pair)
+                    session.marriage_to_csv.append(list(pair))
 
     def local_first(self, loc_data: dict):
         self.first_name = loc_data.get(self.first_name, self.first_name)
 
-    def local_dynasty(self, data: dict, loc_data: dict):
+    def local_dynasty(self, resolver: 'LocResolver'):
         if self.dynasty_house:
-            original_name = data['dynasties'][str(self.dynasty_house)]
-            if loc_name := loc_data.get(original_name.get('name')):
-                self.dynasty_house = loc_name
-            elif key_name := original_name.get('key'):
-                if 'house' in key_name:
-                    self.dynasty_house = (key_name.split('_')[1]).title()
-                else:
-                    self.dynasty_house = (key_name.replace('_', ' ')).title()
-            elif loc_name := original_name.get('localized_name'):
-                self.dynasty_house = loc_name
+            self.dynasty_house = resolver.dynasty(self.dynasty_house)
 
-    def local_title(self, data: dict, loc_data: dict):
+    def local_title(self, resolver: 'LocResolver'):
         if self.titles:
-            original_name = data['landed_titles'][str(self.titles[0])]['key']
-            title_name = self.title_rank(original_name)
-            if original_name in loc_data:
-                self.titles = f'{title_name} of {loc_data[original_name]}'
-            else:
-                self.titles = f'{title_name} of {data['landed_titles'][str(self.titles[0])]['name']}'
+            self.titles = resolver.title(self.titles[0])
 
     @staticmethod
     def title_rank( title: str):
@@ -197,63 +147,50 @@ class Character():
         return rankings[title.split('_', 1)[0]]
 
     def local_traits(self, trait_data: dict):
+
+        # The trait names are the strings of trait_data itself, shared by every character with the trait
         if self.traits:
-            self.traits = [
+            self.traits = tuple(
                 trait_data[str(trait)]
                 for trait in self.traits
                 if str(trait) in trait_data
-            ]
+            )
 
         if self.recessive_traits:
-            self.recessive_traits = [
+            self.recessive_traits = tuple(
                 trait_data[str(trait)]
                 for trait in self.recessive_traits
                 if str(trait) in trait_data
-            ]
+            )
 
-    def local_faith(self, data: dict, loc_data: dict):
+    def local_faith(self, resolver: 'LocResolver'):
         if self.faith:
-            og_faith = (data['religion'][str(self.faith)].get('name') or
-                        data['religion'][str(self.faith)].get('template'))
-            if og_faith in loc_data:
-                self.faith = loc_data[og_faith]
-            else:
-                self.faith = og_faith
+            self.faith = resolver.faith(self.faith)
 
-    def local_culture(self, data:dict , loc_data:dict):
+    def local_culture(self, resolver: 'LocResolver'):
         if self.culture:
-            og_culture = data['culture'][str(self.culture)]['name']
-            if og_culture in loc_data:
-                self.culture = loc_data[og_culture]
-            else:
-                self.culture = og_culture
+            self.culture = resolver.culture(self.culture)
 
     def post_process(self):
 
-        # Processing person data for csv. Creating a note section that you can view in Gramps
-        self.traits = ', '.join(self.traits) if self.traits else None
-        self.recessive_traits = ', '.join(self.recessive_traits) if self.recessive_traits else None
-        self.birth = self.birth.replace('.', '-')
-        self.death_data = self.death_data.replace('.', '-') if self.death_data else None
-        self.skill = ', '.join(self.skill)
-        self.note = (f'ID: {self.id_num}\nName: {self.first_name}\nHouse: {self.dynasty_house}\n'
-                     f'Titles: {self.titles}\nBirth: {self.birth}\nDeath: {self.death_data}\nCause of Death: {self.death_reason}\n'
-                     f'Skills: {self.skill}\nTraits: {self.traits}\nRecessive Traits: {self.recessive_traits}\n'
-                     f'Faith: {self.faith}\nCulture: {self.culture}\nSex: {self.sex}\nOrientation: {self.orientation}\n'
-                     )
-
-    def local_all(self, data, loc_data):
-
-        # Running each localization steps, followed by preparing the person rows for csv.
-        self.local_first(loc_data)
-        self.local_dynasty(data, loc_data)
-        self.local_title(data, loc_data)
-        self.local_traits(loc_data)
-        self.local_faith(data, loc_data)
-        self.local_culture(data, loc_data)
-        self.post_process()
+        # Dates in the format Gramps imports
+        self.birth = intern(self.birth.replace('.', '-'))
+        self.death_data = intern(self.death_data.replace('.', '-')) if self.death_data else None
+
+    def note(self) -> str:
+
+        # The note section that you can view in Gramps, rendered when the csv is written
+        skill = ', '.join(f"{s} {v}" for s, v in zip(Character.skill_names, self.skill))
+        traits = ', '.join(self.traits) if self.traits else None
+        recessive_traits = ', '.join(self.recessive_traits) if self.recessive_traits else None
+        return (f'ID: {self.id_num}\nName: {self.first_name}\nHouse: {self.dynasty_house}\n'
+                f'Titles: {self.titles}\nBirth: {self.birth}\nDeath: {self.death_data}\nCause of Death: {self.death_reason}\n'
+                f'Skills: {skill}\nTraits: {traits}\nRecessive Traits: {recessive_traits}\n'
+                f'Faith: {self.faith}\nCulture: {self.culture}\nSex: {self.sex}\nOrientation: {self.orientation}\n'
+                )
 
-        Character.person_to_csv.append( [
+    def csv_row(self) -> list:
+        return [
             self.id_num,
             self.dynasty_house,
             self.first_name,
@@ -261,85 +198,730 @@ class Character():
             self.birth,
             self.death_data,
             self.titles,
-            self.note
-        ])
+            self.note()
+        ]
+
+    def csv_line(self) -> str:
+
+        # The row as the csv module writes it, which can be kept and written out again as it is
+        line = io.StringIO()
+        csv.writer(line).writerow(self.csv_row())
+        return line.getvalue()
+
+    def local_save(self, resolver: 'LocResolver'):
 
-    @classmethod
-    def to_csv(cls, csv_path: str):
+        # The localization steps that look up save data, memoized by the resolver
+        self.local_dynasty(resolver)
+        self.local_title(resolver)
+        self.local_faith(resolver)
+        self.local_culture(resolver)
 
-        person_header = ['person', 'surname', 'given', 'gender', 'birth date', 'death date', 'title', 'note']
-        marriage_header = ['marriage', 'husband', 'wife']
-        family_header = ['family', 'child']
+    def local_text(self, loc_data: dict):
 
-        csv_path = Path(csv_path)
-        with csv_path.open('w', newline='', encoding='utf-8-sig') as csvfile:
-            writer = csv.writer(csvfile)
+        # The localization steps that only need the localization text, independent for every character
+        self.local_first(loc_data)
+        self.local_traits(loc_data)
+        self.post_process()
+
+    def local_all(self, session: 'ExportSession'):
+
+        # Running each localization steps, followed by writing the person to the output.
+        self.local_save(session.resolver)
+        self.local_text(session.resolver.loc_data)
+
+        session.write_person(self)
+
+
+class ExportSession:
+
+    """State of one export: the characters taken in, the parents of each child, the marriages and families found
+    and the file being written. Each export makes its own session, so exports running at the same time on other
+    threads or processes never share any of it."""
+
+    def __init__(self, data: dict, loc_data: dict):
+        self.resolver = LocResolver(data, loc_data)
+
+        # List of characters
+        self.non_dyn_children = set()
+        self.non_dyn_spouse = set()
+        self.all_id_num = set()
+
+        # Dicts to organize individual into families
+        self.child_to_parents = {}
+        self.families = {}
+        self.family_counter = 1
+
+        # Hashed views of child_to_parents values and marriage_to_csv rows, used for membership checks
+        self.parent_pairs = {}
+        self.marriage_pairs = set()
 
-            writer.writerow(person_header)
+        # Processed data prepared to write to csv file. People are written as soon as they are localized instead
+        self.marriage_to_csv =[]
+        self.families_to_csv = []
+        self.writer = None
 
-            for person in cls.person_to_csv:
-                writer.writerow(person)
+    def add_non_dynasty(self) -> list:
+        data = self.resolver.data
+        self.non_dyn_children = {str(member) for member in self.non_dyn_children} - self.all_id_num
+        self.non_dyn_spouse = {str(member) for member in self.non_dyn_spouse} - self.all_id_num
+        self.non_dyn_children = self.non_dyn_children - self.non_dyn_spouse
+
+        non_members = []
+        for non_member in self.non_dyn_children:
+            try:
+                character = Character(non_member, data['characters'][non_member], self,dyn_flag=False)
+                non_members.append(character)
+            except KeyError:
+                print(f'Character ID {non_member} is skipped')
+                continue
+        for non_member in self.non_dyn_spouse:
+            try:
+                character = Character(non_member, data['characters'][non_member], self,dyn_flag=False,
+                                      non_dyn_spouse= True)
+                non_members.append(character)
+            except KeyError:
+                print(f'Character ID {non_member} is skipped')
+                continue
 
-            writer.writerow([''] * 8)
 
-            writer.writerow(marriage_header)
-            for marriage in cls.marriage_to_csv:
-                writer.writerow(marriage)
+        return non_members
 
-            writer.writerow([''] * 8)
+    def count_parent_pair(self, pair: tuple, change: int):
 
-            writer.writerow(family_header)
-            for family in cls.families_to_csv:
-                writer.writerow(family)
-    @classmethod
-    def reset_data(cls):
-        cls.non_dyn_children.clear()
-        cls.non_dyn_spouse.clear()
-        cls.all_id_num.clear()
-        cls.child_to_parents.clear()
-        cls.families.clear()
-        cls.family_counter = 1
-        cls.person_to_csv.clear()
-        cls.marriage_to_csv.clear()
-        cls.families_to_csv.clear()
+        # Keeps parent_pairs as a count of each (husband, wife) value in child_to_parents
+        count = self.parent_pairs.get(pair, 0) + change
+        if count:
+            self.parent_pairs[pair] = count
+        else:
+            del self.parent_pairs[pair]
+
+    def add_marriage_id(self):
+        for marriage in self.marriage_to_csv:
+            marriage.insert(0,f'm{self.family_counter}')
+            self.family_counter += 1
+        return
+
+    def add_parents_note(self):
+
+        # Match spouse pairs with children. Prepping the marriage and family rows for csv
+        for child, parents in self.child_to_parents.items():
+            parent_pair = (parents['husband'], parents['wife'])
+
+            if parent_pair not in self.families:
+                marriage_id = f"m{self.family_counter}"
+                self.families[parent_pair] = {
+                    "marriage": marriage_id,
+                    "husband": parents['husband'],
+                    "wife": parents['wife'],
+                    "child": []
+                }
+                self.family_counter += 1
+            self.families[parent_pair]["child"].append(child)
+
+        for parents, family_info in self.families.items():
+            self.marriage_to_csv.append([family_info['marriage'],family_info['husband'],family_info['wife']])
+            for child in family_info['child']:
+                self.families_to_csv.append([family_info['marriage'], child])
+
+    def localize_parallel(self, history: list, workers: int, progress=None, cancel: CancelToken = None):
+
+        """Same result as calling local_all on every character in order, with the text localization and the
+        rendering for the writer done in worker processes. The save lookups stay here, where the resolver memoizes
+        them, so the workers only get the localization text the characters use. history is split into shards whose
+        people are written in order as they come back. Shards not yet started are dropped when cancel is
+        cancelled."""
+
+        cancel = cancel or CancelToken()
+        loc_data = self.resolver.loc_data
+        for hist in history:
+            cancel.check()
+            hist.local_save(self.resolver)
+        shard_loc_data = {key: loc_data[key] for key in self.loc_keys(history) if key in loc_data}
+
+        shard_size = max(1, -(-len(history) // (workers * 4)))
+        shards = [history[i:i + shard_size] for i in range(0, len(history), shard_size)]
+        done = 0
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_shard,
+                                 initargs=(shard_loc_data, self.writer.render)) as pool:
+            for rows in pool.map(_localize_shard, shards):
+                if cancel.cancelled:
+                    pool.shutdown(cancel_futures=True)
+                    cancel.check()
+                for row in rows:
+                    self.writer.write(row)
+                done += len(rows)
+                if progress is None:
+                    print(f'{done}/{len(history)} Characters Processed')
+                else:
+                    progress('characters', done, len(history))
+
+    def localize_incremental(self, history: list, state: 'ExportState', progress=None, cancel: CancelToken = None):
+
+        """Same result as calling local_all on every character in order, but the characters that are unchanged
+        since the export state was saved are written from it instead of being localized and rendered again. The
+        save lookups are still done for everyone, since they are memoized and renamed houses or titles have to show
+        up as changes. The collector is paused meanwhile, as it would otherwise walk the saved characters over and
+        over while nothing they hold can become cyclic garbage."""
+
+        cancel = cancel or CancelToken()
+        loc_data = self.resolver.loc_data
+        with gc_paused():
+            for hist in history:
+                cancel.check()
+                hist.local_save(self.resolver)
+            state.check(type(self.writer).__name__, {key: loc_data.get(key) for key in self.loc_keys(history)})
+
+            for count, hist in enumerate(history):
+                cancel.check()
+                key = state.key(hist, self.writer.context(hist))
+                rendered = state.reuse(hist.id_num, key)
+                if rendered is None:
+                    hist.local_text(loc_data)
+                    rendered = self.writer.render(hist)
+                state.keep(hist.id_num, key, rendered)
+                self.writer.write(rendered)
+                history[count] = None
+                if progress is None:
+                    print(f'{count+1}/{len(history)} Characters Processed')
+                else:
+                    progress('characters', count + 1, len(history))
+
+    @staticmethod
+    def loc_keys(history: list) -> set:
+
+        # The localization keys of the first names and traits of the characters, before local_text
+        used = {hist.first_name for hist in history}
+        used.update(str(trait) for hist in history for trait in chain(hist.traits or (), hist.recessive_traits or ()))
+        return used
+
+    @contextlib.contextmanager
+    def output(self, out_path: str):
+
+        """Opens out_path for the people, marriages and families of the export and yields its writer. A name ending
+        with .gramps gets Gramps XML, which is always gzip compressed, and any other a csv, gzip compressed when the
+        name ends with .gz. Everything goes to a .part file next to it, which only takes the name once the block
+        completes, so a failed or cancelled export leaves no half written file."""
+
+        out_path = Path(out_path)
+        part_path = out_path.with_name(out_path.name + '.part')
+        gramps = out_path.suffix == '.gramps'
+        try:
+            with contextlib.ExitStack() as stack:
+                stream = stack.enter_context(part_path.open('wb', buffering=csv_buffer_size))
+                if gramps or out_path.suffix == '.gz':
+                    # mtime is left out of the header so the same export always gives the same file. Level 6, as the
+                    # gzip tool uses, is much faster than the default 9 for slightly larger files
+                    stream = stack.enter_context(gzip.GzipFile(out_path.name, 'wb', compresslevel=6, fileobj=stream,
+                                                               mtime=0))
+                text = stack.enter_context(io.TextIOWrapper(stream, encoding='utf-8' if gramps else 'utf-8-sig',
+                                                            newline=''))
+                if gramps:
+                    self.writer = GrampsWriter(text, self.marriage_to_csv, self.families_to_csv, part_path.parent)
+                    stack.callback(self.writer.close)
+                else:
+                    self.writer = CsvWriter(text, self.marriage_to_csv, self.families_to_csv)
+                yield self.writer
+            part_path.replace(out_path)
+        finally:
+            self.writer = None
+            part_path.unlink(missing_ok=True)
+
+    def write_person(self, person: Character):
+        self.writer.write(self.writer.render(person))
+
+
+class CsvWriter:
+
+    """Writes the people of an export as they come, then its marriages and families, in the CSV format Gramps
+    imports. render turns a localized character into its formatted row, and is picklable for the workers of a
+    parallel export."""
+
+    person_header = ['person', 'surname', 'given', 'gender', 'birth date', 'death date', 'title', 'note']
+    marriage_header = ['marriage', 'husband', 'wife']
+    family_header = ['family', 'child']
+
+    def __init__(self, stream, marriages: list, families: list):
+        self.stream = stream
+        self.csv_writer = csv.writer(stream)
+        self.marriages = marriages
+        self.families = families
+        self.render = Character.csv_line
+        self.csv_writer.writerow(self.person_header)
+
+    def context(self, character: Character) -> tuple:
+
+        # What a row depends on besides the character itself, nothing for a csv row
+        return ()
+
+    def write(self, line: str):
+        self.stream.write(line)
+
+    def finish(self):
+
+        # The marriage and family sections follow the people, each after a blank row
+        writer = self.csv_writer
+        writer.writerow([''] * 8)
+
+        writer.writerow(self.marriage_header)
+        writer.writerows(self.marriages)
+
+        writer.writerow([''] * 8)
+
+        writer.writerow(self.family_header)
+        writer.writerows(self.families)
+
+
+class ExportState:
+
+    """What an export wrote for each character, saved next to its file so the next export of the same tree from a
+    later save only localizes and renders the characters that changed. A character is unchanged when its key, the
+    attributes it was built with after the save lookups plus the context of the writer, is equal to the saved one.
+    A state saved for another output format, or before the localization of the names and traits in use changed, is
+    not used."""
+
+    # Bumped whenever what is saved changes, so older states get rebuilt. States of version 1 hold no
+    # localization when their export started without a state
+    version = 2
+    attributes = attrgetter(*Character.__slots__)
+
+    def __init__(self, state_path: str):
+        self.state_path = Path(state_path)
+        self.output_format = None
+        self.saved = {}
+        self.previous = {}
+        self.localization = {}
+        self.current = {}
+        self.reused = 0
+        saved = {}
+        try:
+            with self.state_path.open('rb') as r, gc_paused():
+                saved = pickle.load(r)
+        except FileNotFoundError:
+            pass
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError) as e:
+            print(f'Export state {self.state_path} could not be read, exporting everything: {e}')
+
+        # A file of another shape, like one written by something else under that name, is not used either
+        if isinstance(saved, dict) and all(isinstance(saved.get(key), dict) for key in ('characters', 'localization')):
+            self.saved = saved
+        elif saved:
+            print(f'Export state {self.state_path} is not an export state, exporting everything')
+
+    def check(self, output_format: str, localization: dict):
+
+        # Takes the saved characters when they were written in the same format with the same localization text
+        # for the keys in use. The text of those keys is kept for the next export either way
+        self.output_format = output_format
+        saved = self.saved
+        self.saved = {}
+        if saved.get('version') == self.version and saved.get('format') == output_format:
+            self.previous = saved['characters']
+            self.localization = saved['localization']
+            if any(self.localization.get(key, text) != text for key, text in localization.items()):
+                print('Localization changed since the last export, exporting everything')
+                self.previous = {}
+                self.localization = {}
+        self.localization.update(localization)
+
+    def key(self, character: Character, context: tuple) -> tuple:
+        return self.attributes(character) + context
+
+    def reuse(self, id_num: str, key: tuple):
+        saved = self.previous.get(id_num)
+        if saved is not None and saved[0] == key:
+            self.reused += 1
+            return saved[1]
+        return None
+
+    def keep(self, id_num: str, key: tuple, rendered):
+        self.current[id_num] = (key, rendered)
+
+    def save(self):
+        part_path = self.state_path.with_name(self.state_path.name + '.part')
+        try:
+            with part_path.open('wb') as w:
+                pickle.dump({'version': self.version, 'format': self.output_format, 'characters': self.current,
+                             'localization': self.localization}, w, protocol=pickle.HIGHEST_PROTOCOL)
+            part_path.replace(self.state_path)
+        finally:
+            part_path.unlink(missing_ok=True)
+        print(f'{self.reused}/{len(self.current)} characters reused from the last export')
+
+
+# Localization text and writer render function of the export a worker process of localize_parallel is working on
+_shard_loc_data = None
+_shard_render = None
+
+
+def _init_shard(loc_data: dict, render):
+    global _shard_loc_data, _shard_render
+    _shard_loc_data = loc_data
+    _shard_render = render
+
+
+def _localize_shard(shard: list) -> list:
+    rows = []
+    for hist in shard:
+        hist.local_text(_shard_loc_data)
+        rows.append(_shard_render(hist))
+    return rows
+
+
+class LocResolver:
+
+    """Localizes the raw house, title, faith and culture IDs of an export, and finds the house heads used for
+    missing faiths and cultures. Every answer is kept in a memo table per kind, so the work grows with the number
+    of distinct IDs rather than characters. hits and misses count the lookups per kind that were answered from the
+    memo tables or had to be worked out."""
+
+    kinds = ('head', 'dynasty', 'title', 'faith', 'culture')
+
+    def __init__(self, data: dict, loc_data: dict):
+        self.data = data
+        self.loc_data = loc_data
+        self.memo = {kind: {} for kind in self.kinds}
+        self.hits = dict.fromkeys(self.kinds, 0)
+        self.misses = dict.fromkeys(self.kinds, 0)
+
+    def lookup(self, kind: str, raw_id, resolve):
+        table = self.memo[kind]
+        if raw_id in table:
+            self.hits[kind] += 1
+            return table[raw_id]
+        self.misses[kind] += 1
+        table[raw_id] = value = resolve(raw_id)
+        return value
+
+    def summary(self) -> str:
+        return ', '.join(f'{kind} {self.hits[kind]} hits/{self.misses[kind]} misses' for kind in self.kinds)
+
+    def house_head(self, house) -> dict:
+        return self.lookup('head', house, self._house_head)
+
+    def dynasty(self, house):
+        return self.lookup('dynasty', house, self._dynasty)
+
+    def title(self, title) -> str:
+        return self.lookup('title', title, self._title)
+
+    def faith(self, faith):
+        return self.lookup('faith', faith, self._faith)
+
+    def culture(self, culture):
+        return self.lookup('culture', culture, self._culture)
+
+    def _house_head(self, house) -> dict:
+        house_head = safe_get(self.data['dynasties'][str(house)])['head_of_house']
+        return self.data['characters'][str(house_head)]
+
+    def _dynasty(self, house):
+        original_name = self.data['dynasties'][str(house)]
+        if loc_name := self.loc_data.get(original_name.get('name')):
+            return loc_name
+        elif key_name := original_name.get('key'):
+            if 'house' in key_name:
+                return (key_name.split('_')[1]).title()
+            return (key_name.replace('_', ' ')).title()
+        elif loc_name := original_name.get('localized_name'):
+            return loc_name
+        return house
+
+    def _title(self, title) -> str:
+        title = str(title)
+        original_name = self.data['landed_titles'][title]['key']
+        title_name = Character.title_rank(original_name)
+        if original_name in self.loc_data:
+            return f'{title_name} of {self.loc_data[original_name]}'
+        return f'{title_name} of {self.data['landed_titles'][title]['name']}'
+
+    def _faith(self, faith):
+        og_faith = (self.data['religion'][str(faith)].get('name') or
+                    self.data['religion'][str(faith)].get('template'))
+        return self.loc_data.get(og_faith, og_faith)
+
+    def _culture(self, culture):
+        og_culture = self.data['culture'][str(culture)]['name']
+        return self.loc_data.get(og_culture, og_culture)
+
+
+class HouseIndex:
+
+    """Cadet houses and house members of a loaded save, built on first use and meant to be kept for as long as the
+    save is. Resolving the houses and members of a main character then takes lookups instead of table scans. With a
+    SaveStore the questions are passed on to its own indexes."""
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.cadets = None
+        self.members = None
+        self.order = None
+
+    def build(self):
+
+        # Builds both tables up front instead of on first use, as for a snapshot of the save
+        if not isinstance(self.data, SaveStore):
+            self.build_cadets()
+            self.build_members()
+
+    def build_cadets(self):
+        self.cadets = {}
+        for key, values in self.data['dynasties'].items():
+            parent = safe_get(values, 'parent_dynasty_house')
+            if isinstance(parent, (int, str)):
+                self.cadets.setdefault(parent, []).append(int(key))
+
+    def build_members(self):
+        self.members = {}
+        self.order = list(self.data['characters'])
+        for position, info in enumerate(self.data['characters'].values()):
+            house = safe_get(info, 'dynasty_house')
+            if isinstance(house, (int, str)):
+                self.members.setdefault(house, []).append(position)
+
+    def cadet_houses(self, house: int) -> list:
+        if isinstance(self.data, SaveStore):
+            return self.data.cadet_houses(house)
+        if self.cadets is None:
+            self.build_cadets()
+        return self.cadets.get(house, [])
+
+    def house_tree(self, main_house: int) -> list:
+
+        # The main house followed by its cadet houses at every level, breadth first
+        houses = [main_house]
+        seen = {main_house}
+        for house in houses:
+            for cadet in self.cadet_houses(house):
+                if cadet not in seen:
+                    seen.add(cadet)
+                    houses.append(cadet)
+        return houses
+
+    def house_members(self, house_list: list):
+
+        # Characters belonging to any house in house_list as (id, info), in save order
+        if isinstance(self.data, SaveStore):
+            yield from self.data.house_members(house_list)
+            return
+        if self.members is None:
+            self.build_members()
+
+        characters = self.data['characters']
+        for position in heapq.merge(*(self.members.get(house, []) for house in set(house_list))):
+            id_num = self.order[position]
+            yield id_num, characters[id_num]
+
+
+class FamilyGraph:
+
+    """Parents, children and spouses of the characters of a loaded save, meant to be kept for as long as the save
+    is, like HouseIndex. Children and spouses are read from the family_data of each character when asked for.
+    Parents are the reverse of every child link, built in one pass over the save on first use, or read from the
+    parents table of a SaveStore that has one."""
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.parent_links = None
+
+    def person(self, id_num: str):
+        return self.data['characters'].get(str(id_num))
+
+    def children(self, id_num: str) -> list:
+        return [str(child) for child in combine_values(safe_get(self.person(id_num), 'family_data', 'child'))]
+
+    def spouses(self, id_num: str) -> list:
+        spouses = safe_get_multiple(self.person(id_num), 'family_data', *Character.spouse_keys)
+        return [str(spouse) for spouse in combine_values(*spouses)]
+
+    def build(self):
+
+        # Builds the parent links up front instead of on first use, as for a snapshot of the save
+        self.parent_links = {}
+        for parent, info in self.data['characters'].items():
+            for child in combine_values(safe_get(info, 'family_data', 'child')):
+                self.parent_links.setdefault(str(child), []).append(parent)
+
+    def parents(self, id_num: str) -> list:
+        if isinstance(self.data, SaveStore) and self.data.has_parents:
+            return self.data.parents(id_num)
+        if self.parent_links is None:
+            self.build()
+        return self.parent_links.get(str(id_num), [])
+
+    def relatives(self, main_id: str, generations: int, in_laws: int = 0) -> list:
+
+        """Walks breadth first from main_id up to its ancestors and down to its descendants, at most generations
+        away, and returns them as (id, info) in the order reached. With in_laws, the spouses met on the way are
+        walked the same way, crossing up to that many marriages, which brings in their own parents and children.
+        Characters missing from the save end their branch of the walk."""
+
+        reached = {}
+        expanded = {}
+        walk = [(str(main_id), 0, True, True, 0)]
+        for id_num, generation, up, down, married in walk:
+            # A character can be met going up, going down or as a spouse, and is walked for each. It is walked again
+            # when a visit has generations or marriages left that no earlier visit the same way had, as when it was
+            # first reached through a spouse and later on a shorter path
+            visits = expanded.setdefault((id_num, up, down), [])
+            if any(seen_married <= married and (not up or seen_generation <= generation)
+                   and (not down or seen_generation >= generation) for seen_generation, seen_married in visits):
+                continue
+            visits.append((generation, married))
+            info = self.person(id_num)
+            if info is None:
+                continue
+            reached.setdefault(id_num, info)
+            if up and generation < generations:
+                walk.extend((parent, generation + 1, True, False, married) for parent in self.parents(id_num))
+            if down and generation > -generations:
+                walk.extend((child, generation - 1, False, True, married) for child in self.children(id_num))
+            if married < in_laws:
+                walk.extend((spouse, generation, True, True, married + 1) for spouse in self.spouses(id_num))
+        return list(reached.items())
 
 # _______________________________________OTHER FUNCTIONS__________________________________________________________#
 
-def find_related_houses(id_num: str, data: dict) -> list:
+def find_related_houses(id_num: str, data: dict, index: HouseIndex = None) -> list:
 
-    # finds cadet houses and adds them to the house list
+    # finds cadet houses at every level and adds them to the house list
+    index = index or HouseIndex(data)
     main_house = data['characters'][id_num]['dynasty_house']
-    all_house=[main_house] + [int(key) for key, values in data['dynasties'].items()
-                    if safe_get(values,'parent_dynasty_house',default=[]) == main_house]
-
-    return all_house
 
+    return index.house_tree(main_house)
 
-def char_main(data: dict, yaml_data: dict, main_id: str, csv_path: str):
 
-    Character.reset_data()
+def export_members(data: dict, yaml_data: dict, members, csv_path: str, progress=None, workers: int = None,
+                   cancel: CancelToken = None, metrics: StageMetrics = None, state_path: str = None):
 
-    house_list = find_related_houses(main_id, data)
+    # Builds the tree of the given house members with their spouses and children, and writes it to csv_path, as
+    # Gramps XML when it ends with .gramps. progress(stage, done, total) replaces the printed count when given. With
+    # more than one worker the localization is spread over that many processes. People are written as they are
+    # localized and let go of, and a cancelled export removes what was written. With a state_path, the export
+    # state saved there by the last export to the same file is used to only localize the characters that changed,
+    # then replaced; workers are not needed then. Each step is timed as a stage of metrics
+    cancel = cancel or CancelToken()
+    metrics = metrics or StageMetrics()
+    session = ExportSession(data, yaml_data)
     history = []
 
     # Loop through characters in JSON and put them in a list of Character objects/instances
-    for id_num, info in data['characters'].items():
-        dynasty_house = safe_get(info, "dynasty_house", default='None')
-        if dynasty_house in house_list:
-            character = Character(id_num, info, data)
+    with metrics.stage('family linking') as stage:
+        for id_num, info in members:
+            cancel.check()
+            character = Character(id_num, info, session)
             history.append(character)
-    # add dyn spouses with no kids marriage for csv.
-    for hist in history:
-        hist.spouse_no_kids()
-    non_member = Character.add_non_dynasty(data)
+        # add dyn spouses with no kids marriage for csv.
+        for hist in history:
+            hist.spouse_no_kids(session)
+        stage['records'] = len(history)
+    with metrics.stage('add_non_dynasty') as stage:
+        non_member = session.add_non_dynasty()
+        stage['records'] = len(non_member)
     history.extend(non_member)
-    Character.add_marriage_id()
-
-
-    Character.add_parents_note()
-    # Performs all localization and provides a count
-    for count,hist in enumerate(history):
-        hist.local_all(data, yaml_data)
-        print(f'{count+1}/{len(history)} Characters Processed')
-
-    Character.to_csv(csv_path)
\ No newline at end of file
+    session.add_marriage_id()
+
+
+    with metrics.stage('add_parents_note', len(session.child_to_parents)):
+        session.add_parents_note()
+    with session.output(csv_path) as writer:
+        # Performs all localization, writing each person, and provides a count
+        with metrics.stage('localization', len(history)):
+            if state_path:
+                state = ExportState(state_path)
+                session.localize_incremental(history, state, progress, cancel)
+            elif workers and workers > 1 and history:
+                session.localize_parallel(history, workers, progress, cancel)
+            else:
+                for count,hist in enumerate(history):
+                    cancel.check()
+                    hist.local_all(session)
+                    history[count] = None
+                    if progress is None:
+                        print(f'{count+1}/{len(history)} Characters Processed')
+                    else:
+                        progress('characters', count + 1, len(history))
+        print(f'Localization lookups: {session.resolver.summary()}')
+
+        cancel.check()
+        with metrics.stage('to_csv', len(session.marriage_to_csv) + len(session.families_to_csv)):
+            writer.finish()
+
+    # Only saved once the file is complete, so a cancelled export leaves the last state in place
+    if state_path:
+        with metrics.stage('state', len(state.current)):
+            state.save()
+
+
+def char_main(data: dict, yaml_data: dict, main_id: str, csv_path: str, index: HouseIndex = None, progress=None,
+              workers: int = None, cancel: CancelToken = None, metrics: StageMetrics = None,
+              generations: int = None, in_laws: int = 0, graph: FamilyGraph = None, state_path: str = None):
+
+    # Exports the main character's house and its cadet houses, or with generations, the ancestors and descendants
+    # of the main character that many generations away, whatever their house, and in_laws marriages deep. Either
+    # way the spouses and children of everyone exported are added. The index and graph can be shared between
+    # exports of the same save. state_path makes the export incremental, see export_members
+    metrics = metrics or StageMetrics()
+    with metrics.stage('char_main'):
+        if generations is None:
+            index = index or HouseIndex(data)
+            with metrics.stage('houses') as stage:
+                house_list = find_related_houses(main_id, data, index)
+                stage['records'] = len(house_list)
+            members = index.house_members(house_list)
+        else:
+            graph = graph or FamilyGraph(data)
+            with metrics.stage('relatives') as stage:
+                members = graph.relatives(main_id, generations, in_laws)
+                stage['records'] = len(members)
+        export_members(data, yaml_data, members, csv_path, progress, workers, cancel, metrics, state_path)
+
+
+def char_batch(data: dict, yaml_data: dict, main_ids: list, csv_dir: str, index: HouseIndex = None,
+               progress=None, workers: int = None, cancel: CancelToken = None, metrics: StageMetrics = None,
+               compress: bool = False, gramps: bool = False, incremental: bool = False) -> dict:
+
+    """Exports the trees of several main characters from one loaded save, writing one CSV per dynasty into csv_dir,
+    gzip compressed with compress, or one .gramps file with gramps. With incremental, each file keeps its export
+    state next to it in a .state file. The members of every requested house are read in a single pass and sorted
+    into each export. Returns the path written for each main ID; main IDs from a house
+    that was already exported are skipped."""
+
+    cancel = cancel or CancelToken()
+    metrics = metrics or StageMetrics()
+    index = index or HouseIndex(data)
+    with metrics.stage('char_batch'):
+        house_roots = {}
+        members = {}
+        main_houses = {}
+        with metrics.stage('houses') as stage:
+            for main_id in main_ids:
+                main_house = data['characters'][main_id]['dynasty_house']
+                if main_house in main_houses.values():
+                    print(f'Character ID {main_id} is skipped, house {main_house} is already exported')
+                    continue
+                main_houses[main_id] = main_house
+                members[main_id] = []
+                for house in find_related_houses(main_id, data, index):
+                    house_roots.setdefault(house, []).append(main_id)
+            stage['records'] = len(house_roots)
+
+        with metrics.stage('members') as stage:
+            for id_num, info in index.house_members(list(house_roots)):
+                cancel.check()
+                for main_id in house_roots[info['dynasty_house']]:
+                    members[main_id].append((id_num, info))
+            stage['records'] = sum(len(house_members) for house_members in members.values())
+
+        csv_dir = Path(csv_dir)
+        csv_dir.mkdir(parents=True, exist_ok=True)
+        csv_paths = {}
+        for main_id, house_members in members.items():
+            extension = '.gramps' if gramps else '.csv.gz' if compress else '.csv'
+            csv_path = csv_dir / f'house_{main_houses[main_id]}{extension}'
+            print(f'Exporting character ID {main_id} to {csv_path}')
+            with metrics.stage(f'char_main {main_id}'):
+                export_members(data, yaml_data, house_members, csv_path, progress, workers, cancel, metrics,
+                               f'{csv_path}.state' if incremental else None)
+            csv_paths[main_id] = str(csv_path)
+
+    return csv_paths
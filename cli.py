@@ -0,0 +1,179 @@
+import argparse
+import configparser
+import contextlib
+import os
+import sys
+import traceback
+import loading_text as lt
+import character as chr
+import save_watcher
+from save_store import closing
+from progress import CancelToken, ProgressReporter
+from metrics import StageMetrics
+
+# Command line front end for headless use. It must not import PySide6, so nothing from main.py is used here.
+
+
+@contextlib.contextmanager
+def stage(reporter, name: str):
+    if reporter:
+        reporter.stage(name, 'started')
+    yield
+    if reporter:
+        reporter.stage(name, 'finished')
+
+
+def convert_json(args, reporter, metrics):
+    with stage(reporter, 'to_json'):
+        stderr = lt.to_json(args.save_file, args.json_file, args.in_process, metrics=metrics)
+    if stderr:
+        raise lt.RakalyError(stderr.strip())
+
+
+def convert_csv(args, reporter, metrics):
+    with stage(reporter, 'loading'):
+        loader = lt.Load()
+        data, yaml_data = loader.loading_main(args.json_file, args.main_id if args.stream else None, metrics=metrics)
+    with stage(reporter, 'export'), closing(data):
+        chr.char_main(data, yaml_data, args.main_id, args.csv_file, index=loader.index, progress=reporter,
+                      workers=args.workers, metrics=metrics, generations=args.generations, in_laws=args.in_laws,
+                      graph=loader.graph, state_path=f'{args.csv_file}.state' if args.incremental else None)
+
+
+def batch(args, reporter, metrics):
+    with stage(reporter, 'loading'):
+        loader = lt.Load()
+        data, yaml_data = loader.loading_main(args.json_file, metrics=metrics)
+    with stage(reporter, 'export'), closing(data):
+        csv_paths = chr.char_batch(data, yaml_data, args.main_ids, args.output_dir, index=loader.index,
+                                   progress=reporter, workers=args.workers, metrics=metrics, compress=args.gzip,
+                                   gramps=args.gramps, incremental=args.incremental)
+    print(f'{len(csv_paths)} {"Gramps" if args.gramps else "CSV"} files created in {args.output_dir}')
+
+
+def watch(args, reporter, metrics):
+    cancel = CancelToken()
+    exporter = save_watcher.SaveExporter(args.json_file, args.main_id, args.output, cancel, progress=reporter,
+                                         stage=reporter.enter if reporter else None, in_process=args.in_process,
+                                         workers=args.workers)
+
+    def convert(save):
+        exporter(save)
+        if reporter:
+            reporter.emit('exported', save=str(save), output=args.output)
+
+    def on_error(save, error):
+        if reporter:
+            reporter.emit('error', save=str(save), message=f'{type(error).__name__}: {error}')
+            reporter.abort()
+        else:
+            save_watcher.print_failure(save, error)
+
+    # Runs until interrupted with Ctrl+C
+    with contextlib.suppress(KeyboardInterrupt):
+        save_watcher.watch(save_watcher.save_folder(args.save_dir), convert, cancel, args.interval, args.settle,
+                           on_error)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Command line front end of the CK3 to Gramps converter.')
+    parser.add_argument('--progress', choices=('text', 'json'), default='text',
+                        help='json writes only JSON lines progress events to stdout, for scripts')
+    parser.add_argument('--metrics', metavar='REPORT',
+                        help='write the time, peak memory and record count of every stage to this JSON file. '
+                             'Memory tracing slows the run down, so compare times between runs with metrics on')
+    parser.add_argument('--profile', metavar='PROFILE', help='write cProfile statistics of the run to this file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    json_parser = commands.add_parser('json', help='convert a save file to JSON or an indexed .sqlite store')
+    json_parser.add_argument('save_file', help='CK3 save file, ironman saves included, or a JSON file created '
+                                              'before to turn into a .sqlite store')
+    json_parser.add_argument('json_file', help='JSON file to create, or a .sqlite file for an indexed store')
+    json_parser.add_argument('--in-process', action='store_true', help='project rakaly output without jq')
+    json_parser.set_defaults(run=convert_json)
+
+    csv_parser = commands.add_parser('csv', help='export the tree of one main character to CSV')
+    csv_parser.add_argument('json_file', help='JSON file or indexed store created from the save')
+    csv_parser.add_argument('main_id', help='main character ID')
+    csv_parser.add_argument('csv_file', help='CSV file to create, gzip compressed when it ends with .gz, or a '
+                                             '.gramps file for Gramps XML')
+    csv_parser.add_argument('--stream', action='store_true',
+                            help='stream the JSON and keep only the needed characters, for low memory machines')
+    csv_parser.add_argument('-j', '--workers', type=int, help='localize the characters in this many processes')
+    csv_parser.add_argument('-g', '--generations', type=int,
+                            help='export the ancestors and descendants of the main character this many generations '
+                                 'away instead of its house')
+    csv_parser.add_argument('--in-laws', type=int, default=0,
+                            help='with --generations, also walk the relatives of spouses, crossing this many marriages')
+    csv_parser.add_argument('--incremental', action='store_true',
+                            help='keep the export state in a .state file next to the output and only localize the '
+                                 'characters that changed since the last export')
+    csv_parser.set_defaults(run=convert_csv)
+
+    batch_parser = commands.add_parser('batch', help='export the trees of several main characters, one CSV each')
+    batch_parser.add_argument('json_file', help='JSON file or indexed store created from the save')
+    batch_parser.add_argument('main_ids', nargs='+', help='main character IDs, one per dynasty')
+    batch_parser.add_argument('-o', '--output-dir', default='.', help='folder the CSV files are written to')
+    batch_parser.add_argument('-j', '--workers', type=int, help='localize the characters in this many processes')
+    batch_parser.add_argument('--gzip', action='store_true', help='write gzip compressed house_ID.csv.gz files')
+    batch_parser.add_argument('--gramps', action='store_true', help='write house_ID.gramps Gramps XML files')
+    batch_parser.add_argument('--incremental', action='store_true',
+                              help='keep the export state in a .state file next to the output and only localize the '
+                                   'characters that changed since the last export')
+    batch_parser.set_defaults(run=batch)
+
+    watch_parser = commands.add_parser('watch', help='convert every new save in the save folder and export the tree '
+                                                     'of one main character from it')
+    watch_parser.add_argument('output', help='CSV file kept up to date with the newest save, gzip compressed when it '
+                                             'ends with .gz, or a .gramps file for Gramps XML')
+    watch_parser.add_argument('--main-id', help='main character ID, by default watch main id in config.ini')
+    watch_parser.add_argument('--save-dir', help='folder to watch, by default game save directory in config.ini')
+    watch_parser.add_argument('--json-file', help='JSON file to convert the saves to, by default next to the output')
+    watch_parser.add_argument('--interval', type=float, default=1.0, help='seconds between two looks at the folder')
+    watch_parser.add_argument('--settle', type=float, default=5.0,
+                              help='seconds a save must stay unchanged before it counts as written')
+    watch_parser.add_argument('--in-process', action='store_true', help='project rakaly output without jq')
+    watch_parser.add_argument('-j', '--workers', type=int, help='localize the characters in this many processes')
+    watch_parser.set_defaults(run=watch)
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'generations', None) is not None and args.stream:
+        # The streaming loader only keeps the main character's houses
+        parser.error('--generations cannot be used with --stream')
+    if args.command == 'watch':
+        config = configparser.ConfigParser()
+        config.read('config.ini')
+        args.main_id = args.main_id or config.get('Default', 'WATCH MAIN ID', fallback='')
+        args.save_dir = args.save_dir or config.get('Default', 'GAME SAVE DIRECTORY', fallback='')
+        args.json_file = args.json_file or save_watcher.default_json_path(args.output)
+        if not args.main_id or not args.save_dir:
+            parser.error('watch needs a main ID and a save folder, from the arguments or config.ini')
+    reporter = ProgressReporter() if args.progress == 'json' else None
+    metrics = StageMetrics(trace_memory=args.metrics is not None, profile_path=args.profile)
+
+    try:
+        with contextlib.ExitStack() as stack:
+            if reporter:
+                # Keeps the human readable messages of the conversion out of the JSON lines
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+            if args.metrics:
+                # Written once the run ends, failed runs included with their unfinished stages marked
+                stack.callback(metrics.write, args.metrics, command=args.command,
+                               arguments={key: value for key, value in vars(args).items()
+                                          if key not in ('run', 'command')})
+            stack.enter_context(metrics)
+            args.run(args, reporter, metrics)
+    except Exception as e:
+        if reporter:
+            reporter.emit('error', message=f'{type(e).__name__}: {e}')
+        else:
+            traceback.print_exc()
+        return 1
+
+    if reporter:
+        reporter.emit('done')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import shutil
+import tempfile
+import time
+from functools import partial
+from xml.sax.saxutils import escape, quoteattr
+
+# Gramps XML output of an export, the format of .gramps files. Gramps imports it without matching rows by ID the
+# way its CSV import does, since every object comes with its handle and all references point at handles.
+
+gramps_xml_version = '1.7.1'
+
+header = f'''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE database PUBLIC "-//Gramps//DTD Gramps XML {gramps_xml_version}//EN"
+"http://gramps-project.org/xml/{gramps_xml_version}/grampsxml.dtd">
+<database xmlns="http://gramps-project.org/xml/{gramps_xml_version}/">
+  <header>
+    <created date="{{date}}" version="5.1.0"/>
+  </header>
+'''
+
+
+# Handles are made from the save IDs, so they are known before anything is written and stay the same from one
+# export of a tree to the next
+def person_handle(id_num: str) -> str:
+    return f'_I{id_num}'
+
+
+def family_handle(husband: str, wife: str) -> str:
+
+    # A family is a couple, one of them unknown at most, unlike the m1, m2... numbering of the csv
+    return f'_F{husband or ""}_{wife or ""}'
+
+
+def date_element(date: str) -> str:
+
+    # Dates arrive as the csv has them, like 1096-5-8
+    parts = date.split('-')
+    if len(parts) == 3 and all(part.isdigit() for part in parts):
+        return '<dateval val="{:04d}-{:02d}-{:02d}"/>'.format(*map(int, parts))
+    return f'<datestr val={quoteattr(date)}/>'
+
+
+def render_person(childof: dict, parentin: dict, change: int, character) -> tuple:
+
+    """The events, person and note elements of a localized character, with the families it is a child and a parent
+    in. A module function, so the workers of a parallel export can render their own characters."""
+
+    id_num = character.id_num
+    handle = person_handle(id_num)
+    events = []
+    refs = []
+    for kind, date, description in (('Birth', character.birth, None),
+                                    ('Death', character.death_data, character.death_reason)):
+        if date is None and description is None:
+            continue
+        event = f'_E{id_num}{kind[0]}'
+        lines = [f'    <event handle="{event}" change="{change}" id="E{id_num}{kind[0]}">\n',
+                 f'      <type>{kind}</type>\n']
+        if date is not None:
+            lines.append(f'      {date_element(date)}\n')
+        if description is not None:
+            lines.append(f'      <description>{escape(str(description))}</description>\n')
+        lines.append('    </event>\n')
+        events.append(''.join(lines))
+        refs.append(f'      <eventref hlink="{event}" role="Primary"/>\n')
+
+    name = [f'        <first>{escape(str(character.first_name))}</first>\n']
+    if character.dynasty_house:
+        name.append(f'        <surname>{escape(str(character.dynasty_house))}</surname>\n')
+    if character.titles:
+        name.append(f'        <title>{escape(str(character.titles))}</title>\n')
+    if id_num in childof:
+        refs.append(f'      <childof hlink="{childof[id_num]}"/>\n')
+    refs.extend(f'      <parentin hlink="{family}"/>\n' for family in parentin.get(id_num, ()))
+
+    person = (f'    <person handle="{handle}" change="{change}" id="I{id_num}">\n'
+              f'      <gender>{"F" if character.sex == "Female" else "M"}</gender>\n'
+              f'      <name type="Birth Name">\n{"".join(name)}      </name>\n'
+              f'{"".join(refs)}'
+              f'      <noteref hlink="_N{id_num}"/>\n'
+              f'    </person>\n')
+    note = (f'    <note handle="_N{id_num}" change="{change}" id="N{id_num}" type="Person Note">\n'
+            f'      <text>{escape(character.note())}</text>\n'
+            f'    </note>\n')
+    return id_num, ''.join(events), person, note
+
+
+class GrampsWriter:
+
+    """Writes the people of an export as they come, then its families, into a Gramps XML stream. Gramps wants the
+    events, people, families and notes in sections of their own, so the people and notes are spooled to temporary
+    files in spool_dir and copied behind the events at the end. marriages and families are the marriage and family
+    rows of the csv. References to people that were never written are left out, as the CSV import skips them."""
+
+    def __init__(self, stream, marriages: list, families: list, spool_dir: str = None):
+        self.stream = stream
+        self.marriages = marriages
+        self.families = families
+        self.written = set()
+        change = int(time.time())
+
+        handles = {marriage_id: family_handle(husband, wife) for marriage_id, husband, wife in marriages}
+        childof = {child: handles[marriage_id] for marriage_id, child in families}
+        parentin = {}
+        for marriage_id, husband, wife in marriages:
+            for parent in (husband, wife):
+                if parent is not None:
+                    parentin.setdefault(parent, []).append(handles[marriage_id])
+        self.render = partial(render_person, childof, parentin, change)
+        self.childof = childof
+        self.parentin = parentin
+        self.change = change
+
+        self.people = tempfile.TemporaryFile('w+', encoding='utf-8', newline='', dir=spool_dir)
+        self.notes = tempfile.TemporaryFile('w+', encoding='utf-8', newline='', dir=spool_dir)
+        stream.write(header.format(date=time.strftime('%Y-%m-%d')))
+        stream.write('  <events>\n')
+
+    def context(self, character) -> tuple:
+
+        # The families a person element links to, besides the character itself
+        id_num = character.id_num
+        return self.childof.get(id_num), tuple(self.parentin.get(id_num, ()))
+
+    def write(self, rendered: tuple):
+        id_num, events, person, note = rendered
+        self.written.add(id_num)
+        self.stream.write(events)
+        self.people.write(person)
+        self.notes.write(note)
+
+    def copy(self, spool):
+        spool.seek(0)
+        shutil.copyfileobj(spool, self.stream)
+
+    def finish(self):
+        stream = self.stream
+        stream.write('  </events>\n  <people>\n')
+        self.copy(self.people)
+
+        children = {}
+        for marriage_id, child in self.families:
+            if child in self.written:
+                children.setdefault(marriage_id, []).append(child)
+        stream.write('  </people>\n  <families>\n')
+        for marriage_id, husband, wife in self.marriages:
+            lines = [f'    <family handle="{family_handle(husband, wife)}" change="{self.change}" '
+                     f'id="F{marriage_id[1:]}">\n',
+                     f'      <rel type="{"Married" if husband and wife else "Unknown"}"/>\n']
+            if husband in self.written:
+                lines.append(f'      <father hlink="{person_handle(husband)}"/>\n')
+            if wife in self.written:
+                lines.append(f'      <mother hlink="{person_handle(wife)}"/>\n')
+            lines.extend(f'      <childref hlink="{person_handle(child)}"/>\n'
+                         for child in children.get(marriage_id, ()))
+            lines.append('    </family>\n')
+            stream.write(''.join(lines))
+
+        stream.write('  </families>\n  <notes>\n')
+        self.copy(self.notes)
+        stream.write('  </notes>\n</database>\n')
+
+    def close(self):
+        self.people.close()
+        self.notes.close()
@@ -0,0 +1,130 @@
+import json
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+_delimiters = ',:]}' + _whitespace
+
+
+class JsonStream:
+
+    """Reads a JSON document from a file object a chunk at a time. Objects are walked key by key with items(), and
+    each value is then either decoded with value(), thrown away with skip() or walked further with items() or
+    elements(). Only the value currently being decoded has to fit in memory, not the whole document."""
+
+    def __init__(self, file, chunk_size: int = 1 << 20, max_record: int = 1 << 24):
+        self.file = file
+        self.chunk_size = chunk_size
+        # Containers bigger than this are walked piece by piece instead of being decoded in one go
+        self.max_record = max_record
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+
+        # Skips whitespace and returns the next character, or an empty string at the end of the document
+        while True:
+            buffer, pos = self.buffer, self.pos
+            while pos < len(buffer) and buffer[pos] in _whitespace:
+                pos += 1
+            self.pos = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char: str):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f'Expecting {char!r}', self.buffer, self.pos)
+        self.pos += 1
+
+    def _decode(self, allow_walk=False):
+
+        """Decodes the value at the current position, reading more chunks while it is incomplete. Returns the
+        stream itself as a marker when allow_walk is set and the value is a container too big to buffer."""
+
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                if (allow_walk and len(self.buffer) - self.pos > self.max_record
+                        and self.buffer[self.pos] in '{['):
+                    return self
+                self._fill()
+                continue
+            # A number cut off by the end of the buffer decodes fine, so check that the value really ended
+            if (end == len(self.buffer) or self.buffer[end] not in _delimiters) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+
+        """Yields the keys of the object at the current position. The caller has to consume each value before
+        asking for the next key."""
+
+        self._expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self._decode()
+            self._expect(':')
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise json.JSONDecodeError("Expecting ',' delimiter", self.buffer, self.pos - 1)
+
+    def elements(self):
+
+        """Yields the index of each element of the array at the current position. Like items(), each element has
+        to be consumed before the next one."""
+
+        self._expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise json.JSONDecodeError("Expecting ',' delimiter", self.buffer, self.pos - 1)
+
+    def value(self):
+        value = self._decode(allow_walk=True)
+        if value is not self:
+            return value
+        if self.peek() == '{':
+            return {key: self.value() for key in self.items()}
+        return [self.value() for _ in self.elements()]
+
+    def skip(self):
+        value = self._decode(allow_walk=True)
+        if value is not self:
+            return
+        if self.peek() == '{':
+            for _ in self.items():
+                self.skip()
+        else:
+            for _ in self.elements():
+                self.skip()
@@ -1,16 +1,177 @@
-
-
 import subprocess
+import contextlib
+import tempfile
+import hashlib
+import pickle
 import json
+import os
+import re
+import signal
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import configparser
-from yaml import load, CSafeLoader
+from json_stream import JsonStream
+from save_store import SaveStore, write_store, data_records, json_records
+from house_cleaning import safe_get, safe_get_multiple, combine_values
+from character import Character, HouseIndex, FamilyGraph, find_related_houses
+from snapshot_cache import SnapshotCache
+from progress import CancelToken
+from metrics import StageMetrics
+
+
+class RakalyError(Exception):
+    """Raised when rakaly can't turn a save file into JSON."""
+
+
+# Where each section used by char_main sits in rakaly's output, mirroring the jq filter in to_json
+save_projection = {
+    'landed_titles': {'landed_titles': 'landed_titles'},
+    'dynasties': {'dynasty_house': 'dynasties'},
+    'living': 'living',
+    'dead_unprunable': 'dead_unprunable',
+    'characters': {'dead_prunable': 'dead_prunable'},
+    'religion': {'faiths': 'religion'},
+    'culture_manager': {'cultures': 'culture'},
+}
+
+
+def project(stream: JsonStream, projection: dict, found: dict):
+
+    # Walks the object at the stream position, keeping the values named in projection and skipping the rest
+    for key in stream.items():
+        target = projection.get(key)
+        if isinstance(target, dict) and stream.peek() == '{':
+            project(stream, target, found)
+        elif isinstance(target, str):
+            found[target] = stream.value()
+        else:
+            stream.skip()
+
+
+def read_stderr(stderr) -> str:
+    stderr.seek(0)
+    return stderr.read().decode('utf-8', 'replace').strip()
+
+
+def stop_process(process: subprocess.Popen):
+
+    # Stops a process started in a session of its own, along with the children of a shell command
+    if process.poll() is not None:
+        return
+    try:
+        if os.name == 'nt':
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], capture_output=True)
+        else:
+            os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
 
 
-def to_json(save_path: str,json_path: str) :
+@contextlib.contextmanager
+def running(process: subprocess.Popen, cancel: CancelToken):
+
+    # Waits for process on exit like the Popen itself, but stops it first when cancel is cancelled or the block
+    # is left by an exception, Ctrl+C included, since it doesn't share the terminal's process group
+    with process, cancel.interrupting(lambda: stop_process(process)):
+        try:
+            yield process
+        except BaseException:
+            stop_process(process)
+            raise
+
+
+def project_save(save_path: str, cancel: CancelToken = None) -> dict:
+
+    """Runs rakaly and projects its output in process, without jq or an intermediate file. Only the five sections
+    used by char_main are kept, the rest of the save is skipped as it streams past. Cancelling stops rakaly."""
+
+    cancel = cancel or CancelToken()
+    cancel.check()
+    command = ['rakaly', 'json', '--duplicate-keys', 'group', '--format', 'utf-8', str(save_path)]
+    found = {}
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, encoding='utf-8',
+                                       start_new_session=True)
+        except FileNotFoundError:
+            raise RakalyError('rakaly executable not found')
+
+        with running(process, cancel):
+            try:
+                project(JsonStream(process.stdout), save_projection, found)
+            except json.JSONDecodeError as e:
+                process.kill()
+                cancel.check()
+                if process.wait() > 0:
+                    raise RakalyError(read_stderr(stderr) or f'rakaly exited with {process.returncode}')
+                raise RakalyError(f'rakaly output could not be read: {e}')
+            process.stdout.close()
+            returncode = process.wait()
+
+        cancel.check()
+        if returncode != 0:
+            raise RakalyError(read_stderr(stderr) or f'rakaly exited with {returncode}')
+
+    # Same merge as jq's object addition: later sections win on duplicate IDs
+    characters = found.get('living') or {}
+    characters.update(found.get('dead_unprunable') or {})
+    characters.update(found.get('dead_prunable') or {})
+
+    return {
+        'landed_titles': found.get('landed_titles'),
+        'dynasties': found.get('dynasties'),
+        'characters': characters,
+        'religion': found.get('religion'),
+        'culture': found.get('culture'),
+    }
+
+
+def to_json(save_path: str,json_path: str, in_process: bool = False, cancel: CancelToken = None,
+            metrics: StageMetrics = None) :
 
     """ Creates Json from ck3 save file using rakaly. Save can be ironman. jq is used to truncate the json from unuseful
-     info to increasing load time"""
+     info to increasing load time. With in_process, the projection is done by project_save instead of jq and
+     failures raise RakalyError rather than returning stderr. A .sqlite json_path writes an indexed SaveStore
+     instead, which is always projected in process. Cancelling stops rakaly and jq and raises ExportCancelled
+     without leaving a partial file behind. A .json save_path, the output of an earlier to_json, is streamed into a
+     .sqlite json_path without being loaded whole"""
+
+    cancel = cancel or CancelToken()
+    metrics = metrics or StageMetrics()
+    with metrics.stage('to_json'):
+        if Path(save_path).suffix == '.json':
+            if Path(json_path).suffix != '.sqlite':
+                raise ValueError('A JSON file can only be converted to a .sqlite store')
+
+            def records():
+                for record in json_records(save_path):
+                    cancel.check()
+                    yield record
+
+            with metrics.stage('write'):
+                write_store(json_path, records())
+            return print(f'Indexed store created in {json_path}')
+
+        if Path(json_path).suffix == '.sqlite' or in_process:
+            with metrics.stage('rakaly') as stage:
+                data = project_save(save_path, cancel)
+                stage['records'] = len(data['characters'])
+            cancel.check()
+
+            with metrics.stage('write', stage['records']):
+                if Path(json_path).suffix == '.sqlite':
+                    write_store(json_path, data_records(data))
+                    return print(f'Indexed store created in {json_path}')
+                with open(json_path, 'w', encoding='utf-8') as w:
+                    json.dump(data, w, separators=(',', ':'), ensure_ascii=False)
+                return print(f'JSON Created in {json_path}')
+
+        return to_json_jq(save_path, json_path, cancel, metrics)
+
+
+def to_json_jq(save_path: str, json_path: str, cancel: CancelToken, metrics: StageMetrics):
+
+    # The shell pipeline of to_json, returning rakaly's or jq's stderr when there is any
 
     command = (
         f'rakaly json --duplicate-keys group --format utf-8 "{save_path}" | jq -c '
@@ -18,15 +179,96 @@ def to_json(save_path: str,json_path: str) :
         'dynasties: .dynasties.dynasty_house, characters: (.living + .dead_unprunable + '
         f'.characters.dead_prunable),religion: .religion.faiths, culture: .culture_manager.cultures}}" > "{json_path}"'
     )
-    result = subprocess.run(command, shell=True, stderr = subprocess.PIPE, text=True)
-    stderr = result.stderr
+    cancel.check()
+    with metrics.stage('rakaly | jq'):
+        process = subprocess.Popen(command, shell=True, stderr = subprocess.PIPE, text=True, start_new_session=True)
+        with running(process, cancel):
+            stderr = process.communicate()[1]
+    if cancel.cancelled:
+        Path(json_path).unlink(missing_ok=True)
+        cancel.check()
 
     if stderr:
         return stderr
     return print(f'JSON Created in {json_path}')
 
 
+# Escape sequences of YAML double quoted strings, which the localization values were read as before
+loc_escapes = {'0': '\0', 'a': '\x07', 'b': '\x08', 't': '\t', '\t': '\t', 'n': '\n', 'v': '\x0b', 'f': '\x0c',
+               'r': '\r', 'e': '\x1b', ' ': ' ', '"': '"', '/': '/', '\\': '\\', 'N': '\x85', '_': '\xa0',
+               'L': '\u2028', 'P': '\u2029'}
+loc_escape_pattern = re.compile(r'\\(x[0-9A-Fa-f]{2}|u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)')
+
+
+def unescape_loc(match) -> str:
+    code = match.group(1)
+    if len(code) > 1:
+        return chr(int(code[1:], 16))
+    return loc_escapes.get(code, match.group(0))
+
+
+def parse_loc_text(text: str, traits: bool = False) -> dict:
+
+    """Parses CK3 localization lines of the form key:0 "value" straight into a dict. Uppercase keys and comments
+    are skipped, and # and : in values become | and - as they did when the lines were corrected into YAML. For the
+    traits file only trait_ keys without descriptions are kept, with the prefix removed."""
+
+    loc_data = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if '"' not in line or line[1:2] == '#':
+            continue
+        key, value = line.split('"', 1)
+        if key.isupper():
+            continue
+        key = key.split(':', 1)[0].strip()
+        value = value.split('"')[0].replace('#', '|').replace(':', '-')
+
+        if traits:
+            line = f'{key}: "{value}'
+            if "_desc:" in line or "_character_desc" in line or 'trait_' not in line:
+                continue
+            key, value = key.replace('trait_', ''), value.replace('trait_', '')
+
+        if key and not key.startswith('#'):
+            loc_data[key] = loc_escape_pattern.sub(unescape_loc, value) if '\\' in value else value
+
+    return loc_data
+
+
+def parse_loc_file(yaml_path: Path):
+
+    # Parses one localization file, or returns None when it is missing. Load.process_yaml may run it in a process pool
+    try:
+        text = yaml_path.read_text(encoding='utf-8-sig')
+    except FileNotFoundError:
+        return None
+    return parse_loc_text(text, 'traits_l' in str(yaml_path))
+
+
+def parse_trait_definitions(text: str) -> list:
+
+    """Reads the top level definitions of a CK3 traits file as (trait, localization key) pairs, in order. The key
+    comes from a plain name = ... line inside the definition when there is one, and is the trait itself otherwise."""
+
+    traits = []
+    depth = 0
+    for line in text.splitlines():
+        line = line.split('#', 1)[0]
+        if depth == 0 and (match := re.match(r'\s*([A-Za-z0-9_]+)\s*=\s*\{', line)):
+            traits.append([match.group(1), match.group(1)])
+        elif depth == 1 and traits and (match := re.match(r'\s*name\s*=\s*([A-Za-z0-9_]+)\s*$', line)):
+            traits[-1][1] = match.group(1).replace('trait_', '', 1)
+        depth += line.count('{') - line.count('}')
+
+    return [tuple(trait) for trait in traits]
+
+
 class Load:
+
+    # Bumped whenever the layout of the cached localization changes, so old caches get rebuilt
+    loc_cache_version = 2
+
     def __init__(self):
 
         # Create a ConfigParser object
@@ -42,9 +284,20 @@ class Load:
             self.resource_path = config.get('Default', 'CK3 RESOURCE DIRECTORY')
         else:
             self.resource_path = './resources'
+        self.language = config.get('Default', 'LANGUAGE', fallback='english')
         self.loc_path = None
         self.processed_yml = []
-        self.processed_traits =[]
+        self.processed_traits = {}
+
+        # Snapshots of whole loaded saves. They are off unless given a size, as they take disk space
+        snapshot_mb = config.getint('Default', 'SNAPSHOT CACHE MB', fallback=0)
+        self.snapshots = None
+        if snapshot_mb > 0:
+            self.snapshots = SnapshotCache(f'{self.resource_path}/snapshots', snapshot_mb << 20)
+
+        # Indexes of the last loaded save, to be passed on to char_main
+        self.index = None
+        self.graph = None
 
     def get_loc_path(self, local_lang='english', get_traits = False):
 
@@ -74,103 +327,280 @@ class Load:
 
 
 
-    def process_yaml(self):
+    def process_yaml(self, workers: int = None):
 
-        """Corrects a YAML file in the resource folder so that they can be loaded in as a Dict. These files will be
-        combined with a traits file that comes with the program. Haven't come up a way to have the traits file
-        automated by user due to inconsistency in naming patterns and localization text traits scattered uses.
-        Used the commented snippet in this function to do the first step of traits yaml processing
-        that continues in a separate traits function"""
+        """Parses the localization files into dicts that will be combined with a traits file that comes with the
+        program. Haven't come up a way to have the traits file automated by user due to inconsistency in naming
+        patterns and localization text traits scattered uses. Each file is parsed by parse_loc_file, in a process
+        pool when there is more than one worker, and the results are kept in the order of loc_path so later files
+        override earlier ones"""
 
-        for yaml_path in self.loc_path:
-            try:
-                text = [line.strip() for line in yaml_path.read_text(encoding='utf-8-sig').splitlines()]
-                cleaned_lines = []
-                for line in text:
-                    if '"' in line and line[1] != '#':
-                        key, value = line.split('"', 1)
-                        if key.isupper():
-                            continue
-                        value = value.split('"')[0] + '"'
-                        value = value.replace('#', '|').replace(':', '-').rstrip() + '\n'
-                        cleaned_lines.append(f"{key.split(':', 1)[0]}: \"{value}")
-
-                if 'traits_l' in str(yaml_path):
-                    cleaned_lines = [line.replace('trait_', '') for line in cleaned_lines if "_desc:" not in line
-                                    and "_character_desc" not in line and 'trait_' in line]
-                    self.processed_traits.extend(cleaned_lines)
-
-                if cleaned_lines:
-                    corrected_yaml = ''.join(cleaned_lines)
-                    self.processed_yml.append(corrected_yaml)
-                    print(f'Processed path {yaml_path}')
-                else:
-                    print(f'Path {yaml_path} not processed.')
+        workers = min(len(self.loc_path), workers or os.cpu_count() or 1)
+        if workers <= 1:
+            # A pool costs more than it saves on one core, spawning a process on Windows re-imports the program
+            results = [parse_loc_file(yaml_path) for yaml_path in self.loc_path]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(parse_loc_file, self.loc_path))
 
-            except FileNotFoundError:
+        for yaml_path, loc_data in zip(self.loc_path, results):
+            if loc_data is None:
                 print(f"File not found: {yaml_path}")
+                continue
+            if 'traits_l' in str(yaml_path):
+                self.processed_traits.update(loc_data)
+
+            if loc_data:
+                self.processed_yml.append(loc_data)
+                print(f'Processed path {yaml_path}')
+            else:
+                print(f'Path {yaml_path} not processed.')
+
+    def trait_paths(self, local_lang: str):
+
+        # The game's trait definition files in load order and the trait localization, or None if any is missing
+        definition_files = sorted(Path(f'{self.ck3_path}/game/common/traits').glob('*.txt'))
+        loc_file = Path(f'{self.ck3_path}/game/localization/{local_lang}/traits_l_{local_lang}.yml')
+        if not definition_files or not loc_file.is_file():
+            return None
+        return definition_files, loc_file
 
-    def loading_traits(self):
-
-        """Create Trait yml file located in Resource folder processed from commented snippet in process_yaml.
-        It matches the order that the trait definition appears in 00_trait.txt with the localized text.
-        Not for user."""
+    def loading_traits(self, local_lang: str):
 
-        try:
-            with open('./resources/00_traits.txt', 'r', encoding='utf-8-sig') as f:
-                lines = [line.split(' ', 1)[0] for line in f.readlines()[1:] if line[0].islower()]
+        """Builds the trait table from the game's trait definitions and localization, joined by localization key.
+        Saves refer to traits by the order they are defined in across common/traits, which gives the index. The
+        table is cached with the localization, whose fingerprint covers the trait files. Returns None when the game
+        files can't be found, in which case the bundled traits.txt is used."""
 
-            combined = []
-            for line in lines:
-                for num, text in enumerate(self.processed_traits):
-                    if line == text.split(':')[0]:
-                        combined.append(f'{(line)}:{text.split(":")[1]}')
-                        break
-                    elif self.processed_traits[num] == self.processed_traits[-1]:
-                        combined.append(f'{(line)}: "NO REFERENCE"\n')
+        trait_paths = self.trait_paths(local_lang)
+        if trait_paths is None:
+            return None
+        definition_files, loc_file = trait_paths
+
+        trait_loc = parse_loc_text(loc_file.read_text(encoding='utf-8-sig'), traits=True)
+        trait_data = {}
+        for definition_file in definition_files:
+            for trait, loc_key in parse_trait_definitions(definition_file.read_text(encoding='utf-8-sig')):
+                trait_data[str(len(trait_data))] = (trait_loc.get(loc_key) or trait_loc.get(trait)
+                                                    or trait.replace('_', ' ').title())
+
+        print(f'{len(trait_data)} Traits Found')
+        return trait_data
+
+    @staticmethod
+    def walk_characters(json_file: Path, visit, cancel: CancelToken = None):
+
+        """Streams the JSON file and calls visit(id_num, stream) for each entry of the characters section. visit has
+        to consume the value from the stream. Every other section is skipped."""
+
+        cancel = cancel or CancelToken()
+        with json_file.open(encoding='utf-8-sig') as r:
+            stream = JsonStream(r)
+            for section in stream.items():
+                cancel.check()
+                if section == 'characters' and stream.peek() == '{':
+                    for id_num in stream.items():
+                        cancel.check()
+                        visit(id_num, stream)
+                else:
+                    stream.skip()
+
+    def stream_data(self, json_file: Path, main_id: str, cancel: CancelToken = None) -> dict:
+
+        """Streams the JSON file instead of loading it whole. Lookup tables are kept in full but characters are only
+        kept when the export of main_id needs them: the members of the related houses, their spouses and children,
+        and the faith and culture of house heads for the fallback in Character. Takes up to three passes through the
+        characters section in exchange for a much lower peak memory."""
+
+        cancel = cancel or CancelToken()
+        data = {}
+        main_char = {}
+
+        # First pass: lookup tables and the main character to find the house list from
+        with json_file.open(encoding='utf-8-sig') as r:
+            stream = JsonStream(r)
+            for section in stream.items():
+                cancel.check()
+                if section != 'characters':
+                    data[section] = stream.value()
+                elif stream.peek() == '{':
+                    for id_num in stream.items():
+                        cancel.check()
+                        if id_num == main_id:
+                            main_char[id_num] = stream.value()
+                        else:
+                            stream.skip()
+                else:
+                    stream.skip()
+
+        data['characters'] = main_char
+        house_list = find_related_houses(main_id, data)
+        heads = {str(safe_get(house, 'head_of_house')) for house in (data.get('dynasties') or {}).values()}
+        characters = {}
+        head_info = {}
+        related = set()
+        relation_keys = ('child', *Character.spouse_keys)
+
+        # Second pass: house members, the relatives that come after them and house heads
+        def keep_members(id_num, stream):
+            info = stream.value()
+            if safe_get(info, 'dynasty_house', default='None') in house_list:
+                characters[id_num] = info
+                related.update(str(member) for member in
+                               combine_values(*safe_get_multiple(info, 'family_data', *relation_keys)))
+            elif id_num in related:
+                characters[id_num] = info
+            elif id_num in heads and isinstance(info, dict):
+                head_info[id_num] = {key: info[key] for key in ('faith', 'culture') if key in info}
+
+        self.walk_characters(json_file, keep_members, cancel)
+        print(f'{len(characters)} Characters Kept')
+
+        # Third pass: relatives that appeared before the member linking to them
+        missing = related - characters.keys()
+        if missing:
+            def keep_missing(id_num, stream):
+                if id_num in missing:
+                    characters[id_num] = stream.value()
+                else:
+                    stream.skip()
 
-            combined[-1] = combined[-1].strip('\n')
+            self.walk_characters(json_file, keep_missing, cancel)
 
-            with open('./resources/traits_trial.txt', 'w', encoding='utf-8-sig') as f:
-                f.writelines(combined)
+        for id_num, info in head_info.items():
+            characters.setdefault(id_num, info)
+        data['characters'] = characters
 
-        except FileNotFoundError as e:
-            print(f"File not found: {e}")
+        return data
 
-    def loading_main(self, json_file: str) -> tuple[dict, dict]:
+    def loc_fingerprint(self, local_lang: str):
 
-        """Main function loading in localization and data file. It also combines that traits file with the combined
-         YAML."""
+        """Hash of the path, size and modification time of every file the localization cache is built from, along
+        with the language and cache version. Returns None when the game's localization can't be found."""
 
-        processed_yml_file = Path(f'{self.resource_path}/loc_data.yml')
-        traits_yml_file = Path(f'{self.resource_path}/traits.txt')
-        json_file = Path(json_file)
+        if not Path(f'{self.ck3_path}/game/localization/{local_lang}').is_dir():
+            return None
+        self.get_loc_path(local_lang)
+        sources = [*self.loc_path, Path(f'{self.resource_path}/traits.txt')]
+        if trait_paths := self.trait_paths(local_lang):
+            sources += [*trait_paths[0], trait_paths[1]]
 
-        if processed_yml_file.is_file():
-            print('Processed YAML Found')
-            with processed_yml_file.open(encoding='utf-8-sig') as r:
-                yaml_data = json.load(r)
-            print('Processed YAML Loaded')
-            with json_file.open(encoding='utf-8-sig') as r:
-                data = json.load(r)
-                print('JSON Loaded')
-        else:
-            self.get_loc_path()
-            self.process_yaml()
+        fingerprint = hashlib.sha256(f'{self.loc_cache_version} {local_lang}'.encode())
+        for source in sources:
+            stat = source.stat()
+            fingerprint.update(f'\n{source.resolve()} {stat.st_size} {stat.st_mtime_ns}'.encode())
+        return fingerprint.hexdigest()
 
-            with traits_yml_file.open(encoding='utf-8-sig') as r:
-                trait_data = r.read()
-                self.processed_yml.append(trait_data)
+    def loading_loc(self) -> dict:
 
-            self.processed_yml = ''.join(self.processed_yml)
-            yaml_data = load(self.processed_yml, Loader=CSafeLoader)
+        """Loads the localization of the configured language from its cache in the resource folder. Each language
+        has its own cache, which is rebuilt from the game files whenever their fingerprint no longer matches. The
+        trait table is generated from the game files along with it."""
 
-            with processed_yml_file.open('w', encoding='utf-8-sig') as w:
-                json.dump(yaml_data, w)
-            with processed_yml_file.open(encoding='utf-8-sig') as r:
-                yaml_data = json.load(r)
+        local_lang = self.language
+        cache_file = Path(f'{self.resource_path}/loc_data_{local_lang}.pickle')
+        traits_yml_file = Path(f'{self.resource_path}/traits.txt')
+        fingerprint = self.loc_fingerprint(local_lang)
 
-            with json_file.open(encoding='utf-8-sig') as r:
-                data = json.load(r)
+        # An unreadable cache, like one cut short by an interrupted rebuild, or one without a fingerprint is rebuilt
+        cache = None
+        try:
+            with cache_file.open('rb') as r:
+                cache = pickle.load(r)
+        except FileNotFoundError:
+            pass
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError) as e:
+            print(f'Localization cache could not be read: {e}')
+        if not isinstance(cache, dict) or not {'fingerprint', 'data'} <= cache.keys():
+            cache = None
+
+        if cache is not None and (fingerprint is None or cache['fingerprint'] == fingerprint):
+            if fingerprint is None:
+                print('Localization folder not found, using the existing cache')
+            print('Processed YAML Loaded')
+            return cache['data']
+        if fingerprint is None:
+            raise Exception(f"Localization folder for {local_lang} not found, Please double check your game directory")
+
+        print('Localization changed, rebuilding cache' if cache is not None else 'Building localization cache')
+        self.process_yaml()
+        trait_data = self.loading_traits(local_lang)
+        if trait_data is None:
+            print('Trait definitions not found, using the bundled traits file')
+            trait_data = parse_loc_text(traits_yml_file.read_text(encoding='utf-8-sig'))
+        self.processed_yml.append(trait_data)
+
+        yaml_data = {}
+        for loc_data in self.processed_yml:
+            yaml_data.update(loc_data)
+
+        # Written aside and moved in place, so an interrupted rebuild leaves the old cache or none at all
+        part_file = cache_file.with_suffix('.part')
+        try:
+            with part_file.open('wb') as w:
+                pickle.dump({'fingerprint': fingerprint, 'data': yaml_data}, w, protocol=pickle.HIGHEST_PROTOCOL)
+            part_file.replace(cache_file)
+        finally:
+            part_file.unlink(missing_ok=True)
+
+        return yaml_data
+
+    def loading_main(self, json_file: str, main_id: str = None, cancel: CancelToken = None,
+                     metrics: StageMetrics = None, snapshot: bool = True) -> tuple[dict, dict]:
+
+        """Main function loading in localization and data file. With a main_id, the data file is streamed and only
+         the characters that export needs are kept. A .ck3 save can be given instead of the JSON file, in which case
+         rakaly's output is projected directly, and a .sqlite store is opened for random access without loading
+         anything up front. cancel is checked between the steps and while streaming, but not inside a plain
+         json.load.
+
+         Without a main_id, JSON files and .ck3 saves are loaded from their snapshot when the cache has one, and
+         otherwise snapshotted with their indexes for the next export, unless snapshot=False or the snapshot cache
+         mb in config.ini is 0. Streamed saves are never snapshotted. The indexes end up in self.index and
+         self.graph."""
+
+        cancel = cancel or CancelToken()
+        metrics = metrics or StageMetrics()
+        json_file = Path(json_file)
+        with metrics.stage('loading_main'):
+            with metrics.stage('localization') as stage:
+                yaml_data = self.loading_loc()
+                stage['records'] = len(yaml_data)
+            cancel.check()
+
+            # A streamed save holds part of the characters only, so only whole ones are snapshotted
+            whole = main_id is None and json_file.suffix in ('.json', '.ck3')
+            snapshots = self.snapshots if snapshot and whole else None
+            with metrics.stage('save') as stage:
+                cached = snapshots.load(json_file) if snapshots else None
+                if cached is not None:
+                    data, self.index, self.graph = cached['data'], cached['index'], cached['graph']
+                    print('Snapshot Loaded')
+                elif json_file.suffix == '.ck3':
+                    data = project_save(json_file, cancel)
+                elif json_file.suffix == '.sqlite':
+                    data = SaveStore(json_file)
+                elif main_id is None:
+                    with json_file.open(encoding='utf-8-sig') as r:
+                        data = json.load(r)
+                else:
+                    data = self.stream_data(json_file, main_id, cancel)
+                stage['records'] = len(data['characters'])
+            cancel.check()
+
+            if cached is None:
+                self.index = HouseIndex(data)
+                self.graph = FamilyGraph(data)
+                if snapshots:
+                    with metrics.stage('snapshot'):
+                        self.index.build()
+                        self.graph.build()
+                        try:
+                            snapshots.store(json_file, {'data': data, 'index': self.index, 'graph': self.graph})
+                        except Exception as e:
+                            # The save is loaded already, so the export goes on and the next one parses it again
+                            print(f'Snapshot could not be written: {e}')
+        cancel.check()
+        print('JSON Loaded')
 
         return data, yaml_data
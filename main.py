@@ -1,47 +1,115 @@
 import sys
 import configparser
+import threading
+import time
 from PySide6.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, \
-    QFileDialog, QTextEdit, QInputDialog, QComboBox, QLineEdit, QMessageBox
-from PySide6.QtCore import QThread, Signal, QObject
+    QFileDialog, QTextEdit, QInputDialog, QComboBox, QLineEdit, QMessageBox, QProgressBar
+from PySide6.QtCore import QThread, Signal, QTimer
 from PySide6.QtGui import QTextCursor,QFont
-from io import StringIO
 import loading_text as lt
 import character as chr
+import save_watcher
+from progress import CancelToken, ExportCancelled, StageClock
+from save_store import closing
 import traceback
 
+# Lines kept in the log window, and how often printed output is moved into it
+LOG_LINES = 5000
+LOG_INTERVAL_MS = 100
 
-class OutputRedirector(QObject):
-    outputWritten = Signal(str)
+# Labels shown on the progress bar for the stages reported by char_main and the steps of watch mode
+stage_labels = {'characters': 'Processing characters', 'to_json': 'Converting save file',
+                'loading': 'Loading game data', 'export': 'Linking families'}
 
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self._buffer = StringIO()
+
+class OutputRedirector:
+
+    """Stands in for sys.stdout. Printed text from any thread is only collected here, and the main window moves
+    it into the log on a timer, so a burst of prints costs one widget update instead of one per line."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
 
     def write(self, text):
-        self._buffer.write(text)
-        self.outputWritten.emit(text)
+        with self._lock:
+            self._pending.append(text)
 
     def flush(self):
         pass
 
+    def drain(self) -> str:
+
+        # Returns the text written since the last call, cut to the lines the log window would keep anyway
+        with self._lock:
+            text = ''.join(self._pending)
+            self._pending.clear()
+        lines = text.splitlines(keepends=True)
+        if len(lines) > LOG_LINES:
+            text = ''.join(lines[-LOG_LINES:])
+        return text
+
 class ConversionWorker(QThread):
     error = Signal(str)
     log = Signal(str)
     finished = Signal(bool, str)
+    # Stage name, done, total and seconds left. A total of 0 means the stage has no count, and the seconds left
+    # are negative until they can be estimated
+    progress = Signal(str, int, int, float)
+    # Stage name and the seconds it took
+    stage_timed = Signal(str, float)
+
+    # Seconds between two progress updates of the same stage
+    progress_interval = 0.1
 
-    def __init__(self, input_file, output_file, main_id=None, conversion_type='json'):
+    def __init__(self, input_file, output_file, main_id=None, conversion_type='json', stream=False):
         super().__init__()
         self.input_file = input_file
         self.output_file = output_file
         self.main_id = main_id
         self.conversion_type = conversion_type
+        self.stream = stream
+        self.last_progress = 0
+        self.cancel_token = CancelToken()
+        self.clock = StageClock()
+        self.current_stage = None
+
+    def cancel(self):
+
+        # Called from the GUI thread. The conversion stops at its next checkpoint and rakaly is terminated
+        self.cancel_token.cancel()
+
+    def enter_stage(self, stage):
+
+        # Reports how long the previous stage took and starts timing the next one. None ends the last stage
+        if self.current_stage is not None:
+            self.stage_timed.emit(self.current_stage, self.clock.elapsed(self.current_stage))
+        self.current_stage = stage
+        if stage is not None:
+            self.clock.start(stage)
+            self.progress.emit(stage, 0, 0, -1.0)
+
+    def report_progress(self, stage, done, total):
+
+        # Progress callback of char_main. Updates are throttled, except for the last one of a stage
+        stage = stage_labels.get(stage, stage)
+        if stage != self.current_stage:
+            self.enter_stage(stage)
+        now = time.perf_counter()
+        if done != total and now - self.last_progress < self.progress_interval:
+            return
+        self.last_progress = now
+        eta = self.clock.eta(stage, done, total)
+        self.progress.emit(stage, done, total, -1.0 if eta is None else eta)
 
     def run(self):
 
         try:
             if self.conversion_type == 'json':
                 self.log.emit("\nStarting conversion to JSON...")
-                stderr = lt.to_json(self.input_file, self.output_file)
+                self.enter_stage('Converting save file')
+                stderr = lt.to_json(self.input_file, self.output_file, cancel=self.cancel_token)
+                self.enter_stage(None)
                 if stderr is None:
                     self.log.emit("JSON conversion completed.")
                     self.finished.emit(True, self.output_file)
@@ -51,17 +119,65 @@ class ConversionWorker(QThread):
 
             else:
                 self.log.emit("\nLoading game data...")
-                data, yaml_data = lt.Load().loading_main(self.input_file)
+                self.enter_stage('Loading game data')
+                loader = lt.Load()
+                # Streaming keeps only the characters of the export, for low memory machines, at several times
+                # the loading time
+                data, yaml_data = loader.loading_main(self.input_file, self.main_id if self.stream else None,
+                                                      self.cancel_token)
                 self.log.emit("Processing character data...")
-                chr.char_main(data, yaml_data, self.main_id, self.output_file)
+                self.enter_stage('Linking families')
+                with closing(data):
+                    chr.char_main(data, yaml_data, self.main_id, self.output_file, index=loader.index,
+                                  progress=self.report_progress, cancel=self.cancel_token, graph=loader.graph)
+                self.enter_stage(None)
                 self.log.emit("\nCSV conversion completed.")
                 self.finished.emit(True, self.output_file)
 
+        except ExportCancelled:
+            self.log.emit("\nConversion cancelled.")
+            self.finished.emit(False, "")
+
         except Exception:
             error_info = traceback.format_exc()
             self.error.emit(error_info)
             self.finished.emit(False, "")
 
+class WatchWorker(ConversionWorker):
+
+    """Watch mode. Converts every new save of save_dir to json_file and exports the tree of main_id from it to
+    output_file, until cancelled. The conversions run on a queue of their own, which keeps only the newest save
+    waiting, and report their progress like a single conversion does."""
+
+    def __init__(self, save_dir, json_file, output_file, main_id):
+        super().__init__(save_dir, output_file, main_id, conversion_type='watch')
+        self.json_file = json_file
+
+    def enter_step(self, stage):
+        self.enter_stage(stage_labels.get(stage, stage) if stage is not None else None)
+        if stage is None:
+            self.progress.emit('Waiting for a new save', 0, 0, -1.0)
+
+    def report_failure(self, save, error):
+
+        # The stage that failed isn't timed, and the next save starts from a clean slate
+        self.current_stage = None
+        self.error.emit(f"{save.name} could not be converted:\n{traceback.format_exc()}")
+        self.progress.emit('Waiting for a new save', 0, 0, -1.0)
+
+    def run(self):
+
+        try:
+            exporter = save_watcher.SaveExporter(self.json_file, self.main_id, self.output_file, self.cancel_token,
+                                                 progress=self.report_progress, stage=self.enter_step)
+            self.progress.emit('Waiting for a new save', 0, 0, -1.0)
+            save_watcher.watch(self.input_file, exporter, self.cancel_token, on_error=self.report_failure)
+            self.finished.emit(True, self.output_file)
+
+        except Exception:
+            self.error.emit(traceback.format_exc())
+            self.finished.emit(False, "")
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -78,8 +194,10 @@ class MainWindow(QMainWindow):
 
         # Set up output redirection
         self.output_redirector = OutputRedirector()
-        self.output_redirector.outputWritten.connect(self.append_log)
         sys.stdout = self.output_redirector
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start(LOG_INTERVAL_MS)
 
         # CK3 Directory
         ck3_layout = QHBoxLayout()
@@ -120,13 +238,26 @@ class MainWindow(QMainWindow):
         self.json_button.clicked.connect(self.convert_to_json)
         self.csv_button = QPushButton("Convert to CSV")
         self.csv_button.clicked.connect(self.convert_to_csv)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_conversion)
+        self.cancel_button.setEnabled(False)
+        self.watch_button = QPushButton("Watch Saves")
+        self.watch_button.clicked.connect(self.toggle_watch)
         button_layout.addWidget(self.json_button)
         button_layout.addWidget(self.csv_button)
+        button_layout.addWidget(self.cancel_button)
+        button_layout.addWidget(self.watch_button)
         layout.addLayout(button_layout)
 
-        # Log output
+        # Progress of the running conversion
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setVisible(False)
+        layout.addWidget(self.progress_bar)
+
+        # Log output, dropping the oldest lines past LOG_LINES
         self.log_output = QTextEdit()
         self.log_output.setReadOnly(True)
+        self.log_output.document().setMaximumBlockCount(LOG_LINES)
         layout.addWidget(self.log_output)
 
     def append_log(self, text):
@@ -134,6 +265,24 @@ class MainWindow(QMainWindow):
         self.log_output.insertPlainText(text)
         self.log_output.moveCursor(QTextCursor.End)
 
+    def flush_log(self):
+
+        # Moves everything printed since the last tick into the log in one update
+        text = self.output_redirector.drain()
+        if text:
+            self.append_log(text)
+
+    def show_progress(self, stage, done, total, eta):
+        if total:
+            self.progress_bar.setRange(0, total)
+            self.progress_bar.setValue(done)
+            left = f', about {eta:.0f} s left' if eta >= 0 else ''
+            self.progress_bar.setFormat(f'{stage}: %v/%m{left}')
+        else:
+            # No count for this stage, so the bar only shows that it is busy
+            self.progress_bar.setRange(0, 0)
+            self.progress_bar.setFormat(stage)
+
     def browse_ck3(self):
         directory = QFileDialog.getExistingDirectory(self, "Select CK3 Directory")
         if directory:
@@ -149,7 +298,8 @@ class MainWindow(QMainWindow):
             self.save_config()
 
     def browse_json(self):
-        file, _ = QFileDialog.getOpenFileName(self, "Select JSON File", "", "JSON Files (*.json)")
+        file, _ = QFileDialog.getOpenFileName(self, "Select JSON File", "",
+                                              "JSON Files (*.json);;Indexed Store (*.sqlite)")
         if file:
             self.json_path.setText(file)
             self.config['Default']['JSON DIRECTORY'] = file
@@ -171,7 +321,8 @@ class MainWindow(QMainWindow):
 
         # Set default output path
         default_output = input_file.rsplit('.', 1)[0] + '.json'
-        output_file, _ = QFileDialog.getSaveFileName(self, "Save JSON File", default_output, "JSON Files (*.json)")
+        output_file, _ = QFileDialog.getSaveFileName(self, "Save JSON File", default_output,
+                                                     "JSON Files (*.json);;Indexed Store (*.sqlite)")
         if output_file:
             self.start_conversion(input_file, output_file, conversion_type='json')
 
@@ -185,42 +336,118 @@ class MainWindow(QMainWindow):
         if ok and main_id:
             # Set default output path
             default_output = input_file.rsplit('.', 1)[0] + '.csv'
-            output_file, _ = QFileDialog.getSaveFileName(self, "Save CSV File", default_output, "CSV Files (*.csv)")
+            output_file, _ = QFileDialog.getSaveFileName(self, "Save CSV File", default_output,
+                                                         "CSV Files (*.csv);;Gramps XML Files (*.gramps)")
             if output_file:
-                self.start_conversion(input_file, output_file, main_id, conversion_type='csv')
+                stream = self.config['Default'].getboolean('STREAM SAVE', fallback=False)
+                self.start_conversion(input_file, output_file, main_id, conversion_type='csv', stream=stream)
 
-    def start_conversion(self, input_file, output_file, main_id=None, conversion_type='json'):
-        self.worker = ConversionWorker(input_file, output_file, main_id, conversion_type)
+    def start_conversion(self, input_file, output_file, main_id=None, conversion_type='json', stream=False):
+        self.worker = ConversionWorker(input_file, output_file, main_id, conversion_type, stream)
         self.worker.error.connect(self.show_error)
         self.worker.log.connect(self.log_message)
+        self.worker.progress.connect(self.show_progress)
+        self.worker.stage_timed.connect(self.show_stage_time)
         self.worker.finished.connect(self.conversion_finished)
         self.worker.start()
 
+        self.progress_bar.setVisible(True)
+        self.cancel_button.setEnabled(True)
+
         self.json_button.setEnabled(False)
         self.csv_button.setEnabled(False)
+        self.watch_button.setEnabled(False)
+
+    def toggle_watch(self):
+        if isinstance(getattr(self, 'worker', None), WatchWorker) and self.worker.isRunning():
+            self.watch_button.setEnabled(False)
+            print('Stopping watch mode...')
+            self.worker.cancel()
+            return
+
+        save_path = self.save_path.text()
+        if not save_path:
+            QMessageBox.warning(self, "No Save File", "Please select a CK3 save file first, its folder is watched.")
+            return
+        main_id, ok = QInputDialog.getText(self, "Enter Main ID", "Main character ID to export from every new save:",
+                                           QLineEdit.Normal, self.config['Default'].get('WATCH MAIN ID', ''))
+        if not ok or not main_id:
+            return
+        json_file = self.json_path.text()
+        default_output = self.config['Default'].get('WATCH OUTPUT') or \
+            (json_file.rsplit('.', 1)[0] + '.csv' if json_file else '')
+        output_file, _ = QFileDialog.getSaveFileName(self, "Save CSV File", default_output,
+                                                     "CSV Files (*.csv);;Gramps XML Files (*.gramps)")
+        if not output_file:
+            return
+
+        # The JSON of the newest save becomes the JSON file, for exporting other trees from it
+        json_file = save_watcher.default_json_path(output_file)
+        self.config['Default']['WATCH MAIN ID'] = main_id
+        self.config['Default']['WATCH OUTPUT'] = output_file
+        self.config['Default']['JSON DIRECTORY'] = json_file
+        self.save_config()
+        self.set_json_path(json_file)
+
+        self.worker = WatchWorker(str(save_watcher.save_folder(save_path)), json_file, output_file, main_id)
+        self.worker.error.connect(self.show_error)
+        self.worker.log.connect(self.log_message)
+        self.worker.progress.connect(self.show_progress)
+        self.worker.stage_timed.connect(self.show_stage_time)
+        self.worker.finished.connect(self.watch_finished)
+        self.worker.start()
+
+        self.progress_bar.setVisible(True)
+        self.watch_button.setText("Stop Watching")
+        self.json_button.setEnabled(False)
+        self.csv_button.setEnabled(False)
+
+    def watch_finished(self, success, output_file):
+        self.flush_log()
+        self.progress_bar.setVisible(False)
+        self.watch_button.setText("Watch Saves")
+        self.watch_button.setEnabled(True)
+        if not success:
+            self.log_output.append("Watch mode failed. Check the above traceback for details.")
+
+        self.json_button.setEnabled(True)
+        self.csv_button.setEnabled(True)
 
     def log_message(self, message):
         print(message)
 
+    def show_stage_time(self, stage, elapsed):
+        print(f'{stage} took {elapsed:.1f} s')
+
+    def cancel_conversion(self):
+        self.cancel_button.setEnabled(False)
+        print('Cancelling...')
+        self.worker.cancel()
+
     def show_error(self, error_message):
+        self.flush_log()
         self.log_output.append(f"Error: {error_message}")
 
     def set_json_path(self, path):
         self.json_path.setText(path)
 
     def conversion_finished(self, success, output_file):
+        self.flush_log()
+        self.progress_bar.setVisible(False)
+        self.cancel_button.setEnabled(False)
         if success:
             self.log_output.append("Conversion completed successfully!")
             QMessageBox.information(self, "Success", "Conversion completed successfully!")
-            if output_file.lower().endswith('.json'):
+            if output_file.lower().endswith(('.json', '.sqlite')):
                 self.set_json_path(output_file)
                 self.config['Default']['JSON DIRECTORY'] = output_file
                 self.save_config()
-        else:
+        elif not self.worker.cancel_token.cancelled:
             self.log_output.append("Conversion failed. Check the above traceback for details.")
 
         self.json_button.setEnabled(True)
         self.csv_button.setEnabled(True)
+        self.watch_button.setEnabled(True)
 
 if __name__ == "__main__":
 
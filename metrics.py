@@ -0,0 +1,104 @@
+import cProfile
+import contextlib
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+report_version = 1
+
+
+class StageMetrics:
+
+    """Wall time, peak memory and record counts of the stages of a conversion, kept in the order they started.
+    Stages nest, and each is named by its path, like char_main/to_csv, so reports of different runs can be lined up.
+    Peak memory comes from tracemalloc and only covers this process, not rakaly or the workers of a parallel
+    export, and so do the held bytes, the memory still allocated as a stage ends. Used as a context manager, it
+    starts memory tracing and the optional cProfile run for its block. Without either, a StageMetrics only costs a
+    clock read per stage, so functions fall back to a throwaway one."""
+
+    def __init__(self, trace_memory: bool = False, profile_path: str = None):
+        self.trace_memory = trace_memory
+        self.profile_path = profile_path
+        self.profiler = None
+        self.owns_tracing = False
+        self.stages = []
+        self.open = []
+        self.started = time.perf_counter()
+        self.seconds = None
+
+    def __enter__(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.owns_tracing = True
+        if self.profile_path:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.started
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+            self.profiler = None
+        if self.owns_tracing:
+            tracemalloc.stop()
+            self.owns_tracing = False
+
+    def _fold_peak(self):
+
+        # Moves the peak since the last reset into every open stage, so a nested stage can reset it for itself
+        if self.trace_memory and tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1]
+            for record in self.open:
+                record['peak_bytes'] = max(record['peak_bytes'] or 0, peak)
+            tracemalloc.reset_peak()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, records: int = None):
+
+        """Times the block as a stage and yields its record, whose records count can be filled in by the block.
+        The record is kept even when the block raises, marked as not completed."""
+
+        # The stage of an open record is already its full path, so only the innermost one is prefixed
+        path = f"{self.open[-1]['stage']}/{name}" if self.open else name
+        record = {'stage': path, 'depth': len(self.open), 'records': records, 'seconds': None, 'peak_bytes': None,
+                  'held_bytes': None, 'completed': False}
+        self._fold_peak()
+        self.stages.append(record)
+        self.open.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+            record['completed'] = True
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 6)
+            self._fold_peak()
+            if self.trace_memory and tracemalloc.is_tracing():
+                record['held_bytes'] = tracemalloc.get_traced_memory()[0]
+            self.open.pop()
+
+    def report(self, **run_info) -> dict:
+        return {
+            'version': report_version,
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'run': run_info,
+            'seconds': round(self.seconds if self.seconds is not None else time.perf_counter() - self.started, 6),
+            'memory_traced': self.trace_memory,
+            'profile': str(self.profile_path) if self.profile_path else None,
+            'stages': self.stages,
+        }
+
+    def write(self, report_path: str, **run_info):
+
+        # run_info, like the command and its files, is stored with the report to tell runs apart when collected
+        report_path = Path(report_path)
+        report_path.write_text(json.dumps(self.report(**run_info), indent=2), encoding='utf-8')
+        print(f'Metrics report written to {report_path}')
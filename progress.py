@@ -0,0 +1,120 @@
+import contextlib
+import json
+import sys
+import threading
+import time
+
+
+class ExportCancelled(Exception):
+    """Raised at the next checkpoint of a conversion once its CancelToken is cancelled."""
+
+
+class CancelToken:
+
+    """Cooperative cancellation of a conversion. cancel() can be called from any thread, and the conversion stops
+    with ExportCancelled at its next check(). Work that can't check while it runs, like a subprocess, registers a
+    callback with interrupting() that stops it when the token is cancelled."""
+
+    def __init__(self):
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+    def check(self):
+        if self.cancelled:
+            raise ExportCancelled('Conversion cancelled')
+
+    @contextlib.contextmanager
+    def interrupting(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+            cancelled = self.cancelled
+        if cancelled:
+            callback()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._callbacks.remove(callback)
+
+
+class StageClock:
+
+    """Elapsed time of each stage, and an estimate of the time left from the records done so far. A stage counts
+    from its start() or, for stages that only report records, from its first record."""
+
+    def __init__(self):
+        self.started = {}
+
+    def start(self, stage: str):
+        self.started[stage] = time.perf_counter()
+
+    def elapsed(self, stage: str) -> float:
+        now = time.perf_counter()
+        return now - self.started.setdefault(stage, now)
+
+    def eta(self, stage: str, done: int, total: int):
+
+        # Seconds left at the average rate so far, or None before there is a rate to go by
+        elapsed = self.elapsed(stage)
+        if done <= 1 or not total or not elapsed:
+            return None
+        return elapsed / (done - 1) * (total - done)
+
+
+class ProgressReporter:
+
+    """Reports progress as one JSON object per line, for scripts driving the command line front end. Updates of a
+    stage are throttled to one per interval, but its first and last updates are always written. Finished stages
+    carry their elapsed seconds and updates an eta in seconds once one can be estimated."""
+
+    def __init__(self, stream=None, interval: float = 0.5):
+        self.stream = stream or sys.stdout
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last = {}
+        self.clock = StageClock()
+        self.current = None
+
+    def emit(self, event: str, **fields):
+        record = {'event': event, 'time': round(time.perf_counter() - self.start, 3), **fields}
+        self.stream.write(json.dumps(record) + '\n')
+        self.stream.flush()
+
+    def stage(self, stage: str, status: str):
+        if status == 'started':
+            self.clock.start(stage)
+            self.emit('stage', stage=stage, status=status)
+        else:
+            self.emit('stage', stage=stage, status=status, elapsed=round(self.clock.elapsed(stage), 3))
+
+    def enter(self, stage: str):
+
+        # Finishes the stage entered before and starts this one, for steps that only report where they start. None
+        # only finishes
+        if self.current is not None:
+            self.stage(self.current, 'finished')
+        self.current = stage
+        if stage is not None:
+            self.stage(stage, 'started')
+
+    def abort(self):
+
+        # Forgets the stage entered last without finishing it, for when an error event already ended it
+        self.current = None
+
+    def __call__(self, stage: str, done: int, total: int):
+        eta = self.clock.eta(stage, done, total)
+        now = time.perf_counter()
+        if done != total and done != 1 and now - self.last.get(stage, 0) < self.interval:
+            return
+        self.last[stage] = now
+        fields = {'eta': round(eta, 1)} if eta is not None else {}
+        self.emit('progress', stage=stage, done=done, total=total, **fields)
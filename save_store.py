@@ -0,0 +1,164 @@
+import contextlib
+import json
+import sqlite3
+from collections.abc import Mapping
+from pathlib import Path
+from json_stream import JsonStream
+from house_cleaning import safe_get, combine_values
+
+sections = ('landed_titles', 'dynasties', 'characters', 'religion', 'culture')
+
+# Indexed column per section, pulled out of each record so house lookups don't need to decode every row
+indexed_keys = {'characters': 'dynasty_house', 'dynasties': 'parent_dynasty_house'}
+
+
+def _indexed_value(section: str, record):
+    key = indexed_keys.get(section)
+    if key is None or not isinstance(record, dict):
+        return None
+    value = record.get(key)
+    return value if isinstance(value, (int, str)) else None
+
+
+def write_store(store_path: str, records):
+
+    """Writes (section, id, record) tuples into a SQLite file. Records are stored as compact JSON keyed by ID, with
+    the house of each character and the parent of each house in their own indexed column. The parents table holds
+    every child link of the characters the other way around, for FamilyGraph. The store is written to a .part file
+    next to it, so a failed write leaves the previous store whole."""
+
+    store_path = Path(store_path)
+    part_path = store_path.with_name(store_path.name + '.part')
+    part_path.unlink(missing_ok=True)
+    try:
+        _write_tables(part_path, records)
+        part_path.replace(store_path)
+    finally:
+        part_path.unlink(missing_ok=True)
+
+
+def _write_tables(store_path: Path, records):
+    connection = sqlite3.connect(store_path)
+    try:
+        for section in sections:
+            connection.execute(f'CREATE TABLE {section} (id TEXT PRIMARY KEY, indexed, body TEXT NOT NULL)')
+        connection.execute('CREATE TABLE parents (child TEXT NOT NULL, parent TEXT NOT NULL)')
+        for section, id_num, record in records:
+            connection.execute(f'INSERT OR REPLACE INTO {section} VALUES (?, ?, ?)',
+                               (str(id_num), _indexed_value(section, record),
+                                json.dumps(record, separators=(',', ':'), ensure_ascii=False)))
+            if section == 'characters':
+                connection.executemany('INSERT INTO parents VALUES (?, ?)',
+                                       ((str(child), str(id_num))
+                                        for child in combine_values(safe_get(record, 'family_data', 'child'))))
+        for section in indexed_keys:
+            connection.execute(f'CREATE INDEX {section}_indexed ON {section} (indexed)')
+        connection.execute('CREATE INDEX parents_child ON parents (child)')
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def data_records(data: dict):
+    for section in sections:
+        for id_num, record in (data.get(section) or {}).items():
+            yield section, id_num, record
+
+
+def json_records(json_file: str):
+
+    # Same records as data_records, streamed from a JSON file so it never has to be loaded whole
+    with Path(json_file).open(encoding='utf-8-sig') as r:
+        stream = JsonStream(r)
+        for section in stream.items():
+            if section in sections and stream.peek() == '{':
+                for id_num in stream.items():
+                    yield section, id_num, stream.value()
+            else:
+                stream.skip()
+
+
+class StoreSection(Mapping):
+
+    """Read only view of one section of the store. Records are decoded on first access and kept, since the same
+    houses, titles, faiths and cultures are looked up over and over during an export."""
+
+    def __init__(self, connection: sqlite3.Connection, section: str):
+        self.connection = connection
+        self.section = section
+        self.cache = {}
+
+    def __getitem__(self, id_num):
+        id_num = str(id_num)
+        if id_num not in self.cache:
+            row = self.connection.execute(f'SELECT body FROM {self.section} WHERE id = ?', (id_num,)).fetchone()
+            if row is None:
+                raise KeyError(id_num)
+            self.cache[id_num] = json.loads(row[0])
+        return self.cache[id_num]
+
+    def __iter__(self):
+        for (id_num,) in self.connection.execute(f'SELECT id FROM {self.section} ORDER BY rowid'):
+            yield id_num
+
+    def __len__(self):
+        return self.connection.execute(f'SELECT COUNT(*) FROM {self.section}').fetchone()[0]
+
+    def where(self, values):
+
+        # Yields (id, record) for every row whose indexed column is one of values, in insertion order
+        values = list(values)
+        if not values:
+            return
+        query = (f'SELECT id, body FROM {self.section} WHERE indexed IN ({", ".join("?" * len(values))}) '
+                 f'ORDER BY rowid')
+        for id_num, body in self.connection.execute(query, values):
+            yield id_num, json.loads(body)
+
+
+class SaveStore(Mapping):
+
+    """Indexed alternative to the projected JSON, opened from a file written by write_store. Behaves like the data
+    dict returned by Load.loading_main, but only the records an export touches are ever read."""
+
+    def __init__(self, store_path: str):
+        self.connection = sqlite3.connect(f'{Path(store_path).resolve().as_uri()}?mode=ro', uri=True,
+                                          check_same_thread=False)
+        self.sections = {section: StoreSection(self.connection, section) for section in sections}
+        # Stores written before the parents table was added leave FamilyGraph to build the links itself
+        self.has_parents = self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'parents'").fetchone() is not None
+
+    def __getitem__(self, section):
+        return self.sections[section]
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def house_members(self, house_list):
+        return self['characters'].where(house_list)
+
+    def cadet_houses(self, house):
+        return [int(id_num) for id_num, _ in self['dynasties'].where([house])]
+
+    def parents(self, id_num) -> list:
+        return [parent for (parent,) in self.connection.execute(
+            'SELECT parent FROM parents WHERE child = ? ORDER BY rowid', (str(id_num),))]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def closing(data):
+
+    # Context manager closing the data returned by Load.loading_main when it is a SaveStore, dicts need nothing
+    return data if isinstance(data, SaveStore) else contextlib.nullcontext(data)
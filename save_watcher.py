@@ -0,0 +1,213 @@
+import threading
+import time
+import traceback
+from pathlib import Path
+import loading_text as lt
+import character as chr
+from progress import CancelToken, ExportCancelled
+from save_store import closing
+
+# Watch mode: the save folder is polled for new .ck3 files, and the newest one is converted to JSON and exported
+# once the game is done writing it. Polling needs no extra dependency and behaves the same on every platform.
+
+# Suffixes of the outputs export_members writes, longest first
+output_suffixes = ('.csv.gz', '.csv', '.gramps')
+
+
+def save_folder(save_path: str) -> Path:
+
+    # GAME SAVE DIRECTORY in config.ini holds the save last picked in the GUI, or a folder
+    path = Path(save_path)
+    return path if path.is_dir() else path.parent
+
+
+def default_json_path(output_path: str) -> str:
+
+    # The JSON of a watch mode export sits next to its output, tree.csv.gz getting tree.json. Only the output
+    # suffix is replaced, so my.tree.csv gets my.tree.json
+    output_path = Path(output_path)
+    name = output_path.name
+    for suffix in output_suffixes:
+        if name.lower().endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return str(output_path.with_name(f'{name}.json'))
+
+
+class SaveWatcher:
+
+    """Finds the saves written into folder. The game writes a save over several seconds, so a save is only handed
+    out once its size and modification time stayed the same for settle seconds. Of the saves settling at the same
+    poll only the newest is handed out. Watching starts from the newest save already in the folder, the older ones
+    are never converted."""
+
+    def __init__(self, folder, settle: float = 5.0, pattern: str = '*.ck3'):
+        self.folder = Path(folder)
+        self.settle = settle
+        self.pattern = pattern
+        # Saves changing since the last poll, with the size and modification time they had when first seen so
+        self.pending = {}
+        stats = self.scan()
+        newest = max(stats, key=lambda path: stats[path][1], default=None)
+        self.handled = {path: stat for path, stat in stats.items() if path != newest}
+
+    def scan(self) -> dict:
+        stats = {}
+        for path in self.folder.glob(self.pattern):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # Removed meanwhile, as the game does with its oldest autosave
+                continue
+            stats[path] = (stat.st_size, stat.st_mtime_ns)
+        return stats
+
+    def poll(self, now: float = None) -> Path:
+
+        # The newest save that settled since the last poll, or None
+        now = time.monotonic() if now is None else now
+        stats = self.scan()
+        settled = []
+        for path, stat in stats.items():
+            if not stat[0] or self.handled.get(path) == stat:
+                continue
+            seen = self.pending.get(path)
+            if seen is None or seen[0] != stat:
+                self.pending[path] = (stat, now)
+            elif now - seen[1] >= self.settle:
+                settled.append(path)
+        self.pending = {path: seen for path, seen in self.pending.items() if path in stats}
+
+        for path in settled:
+            self.handled[path] = stats[path]
+            del self.pending[path]
+        if not settled:
+            return None
+        newest = max(settled, key=lambda path: stats[path][1])
+        for path in settled:
+            if path != newest:
+                print(f'{path.name} skipped, superseded by {newest.name}')
+        return newest
+
+
+def print_failure(save: Path, error: Exception):
+    print(f'{save.name} could not be converted:')
+    traceback.print_exc()
+
+
+class ConversionQueue:
+
+    """Converts saves one at a time on a background thread. Only one save waits behind the conversion running, and
+    a newer save put in replaces it, so a burst of saves ends with the newest converted instead of all of them in
+    turn. on_error(save, exception) is called for failed conversions, which don't stop the queue, and prints the
+    traceback by default."""
+
+    def __init__(self, convert, on_error=None):
+        self.convert = convert
+        self.on_error = on_error or print_failure
+        self.condition = threading.Condition()
+        self.waiting = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='save-conversion', daemon=True)
+        self.thread.start()
+
+    def put(self, save: Path):
+        with self.condition:
+            if self.waiting is not None:
+                print(f'{self.waiting.name} skipped, superseded by {save.name}')
+            self.waiting = save
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.waiting is None and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                save, self.waiting = self.waiting, None
+            try:
+                self.convert(save)
+            except ExportCancelled:
+                pass
+            except Exception as e:
+                self.on_error(save, e)
+
+    def close(self):
+
+        # Drops the waiting save and returns once the running conversion ended
+        with self.condition:
+            self.closed = True
+            self.waiting = None
+            self.condition.notify()
+        self.thread.join()
+
+
+class SaveExporter:
+
+    """The conversion of a watched save: to_json into json_path, then the export of main_id's tree to output_path.
+    The export is incremental from the state of the one before, as the trees of successive saves differ little,
+    and skips the snapshot cache, every save being loaded once. stage(name) is called as every step starts, and
+    with None once the export is written, and progress is passed on to char_main."""
+
+    def __init__(self, json_path: str, main_id: str, output_path: str, cancel: CancelToken, progress=None,
+                 stage=None, in_process: bool = False, workers: int = None):
+        self.json_path = json_path
+        self.main_id = main_id
+        self.output_path = output_path
+        self.cancel = cancel
+        self.progress = progress
+        self.stage = stage or (lambda name: None)
+        self.in_process = in_process
+        self.workers = workers
+        self.loader = lt.Load()
+
+    def __call__(self, save: Path):
+        started = time.perf_counter()
+        print(f'\nConverting {save.name}...')
+        self.stage('to_json')
+
+        # Converted beside the JSON of the save before, which stays whole until this one is
+        json_path = Path(self.json_path)
+        part_path = json_path.with_name(f'{json_path.stem}.part{json_path.suffix}')
+        try:
+            stderr = lt.to_json(str(save), str(part_path), self.in_process, cancel=self.cancel)
+            if stderr:
+                raise lt.RakalyError(stderr.strip())
+            part_path.replace(json_path)
+        finally:
+            part_path.unlink(missing_ok=True)
+
+        self.stage('loading')
+        loader = self.loader
+        data, yaml_data = loader.loading_main(self.json_path, cancel=self.cancel, snapshot=False)
+        self.stage('export')
+        with closing(data):
+            chr.char_main(data, yaml_data, self.main_id, self.output_path, index=loader.index,
+                          progress=self.progress, workers=self.workers, cancel=self.cancel, graph=loader.graph,
+                          state_path=f'{self.output_path}.state')
+        self.stage(None)
+        print(f'{save.name} exported to {self.output_path} in {time.perf_counter() - started:.1f} s')
+
+
+def watch(folder, convert, cancel: CancelToken, interval: float = 1.0, settle: float = 5.0, on_error=None):
+
+    """Polls folder every interval seconds and puts the saves it settles into a ConversionQueue running convert,
+    until cancel is cancelled. The token is cancelled on the way out as well, so an exception like a
+    KeyboardInterrupt also stops the conversion running before watch returns."""
+
+    watcher = SaveWatcher(folder, settle)
+    queue = ConversionQueue(convert, on_error)
+    wake = threading.Event()
+    print(f'Watching {watcher.folder} for new saves')
+    try:
+        with cancel.interrupting(wake.set):
+            while not cancel.cancelled:
+                save = watcher.poll()
+                if save is not None:
+                    queue.put(save)
+                wake.wait(interval)
+    finally:
+        cancel.cancel()
+        queue.close()
+    print('Stopped watching')
@@ -0,0 +1,84 @@
+import contextlib
+import gc
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+# Bumped whenever the layout of a snapshot or the classes pickled in it change, so old snapshots are never loaded
+snapshot_version = 1
+
+
+@contextlib.contextmanager
+def gc_paused():
+
+    # Unpickling a save creates millions of containers, and the collector would walk them over and over meanwhile
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class SnapshotCache:
+
+    """Loaded saves kept as pickles in folder, along with the indexes built on them, so later exports from the same
+    save skip parsing the JSON and building the indexes. A save's snapshot is found by a fingerprint of its path,
+    size and modification time. The folder is held under max_bytes by removing the least recently used snapshots,
+    the one just written included when it doesn't fit on its own."""
+
+    def __init__(self, folder: str, max_bytes: int):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def fingerprint(source: Path) -> str:
+        stat = source.stat()
+        fingerprint = hashlib.sha256(f'{snapshot_version} {source.resolve()} {stat.st_size} {stat.st_mtime_ns}'
+                                     .encode())
+        return fingerprint.hexdigest()
+
+    def path(self, source: Path) -> Path:
+        return self.folder / f'{self.fingerprint(Path(source))}.pickle'
+
+    def load(self, source: str):
+
+        # The snapshot of source, or None when there is none or it can't be read
+        snapshot_path = self.path(source)
+        try:
+            with snapshot_path.open('rb') as r, gc_paused():
+                snapshot = pickle.load(r)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            print(f'Snapshot {snapshot_path.name} could not be read and is removed: {e}')
+            snapshot_path.unlink(missing_ok=True)
+            return None
+        # The modification time of a snapshot is when it was last used
+        os.utime(snapshot_path)
+        return snapshot
+
+    def store(self, source: str, snapshot: dict):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        snapshot_path = self.path(source)
+        part_path = snapshot_path.with_suffix('.part')
+        try:
+            with part_path.open('wb') as w:
+                pickle.dump(snapshot, w, protocol=pickle.HIGHEST_PROTOCOL)
+            part_path.replace(snapshot_path)
+        finally:
+            part_path.unlink(missing_ok=True)
+        self.evict()
+
+    def evict(self):
+        snapshots = sorted(self.folder.glob('*.pickle'), key=lambda path: path.stat().st_mtime, reverse=True)
+        total = 0
+        for snapshot_path in snapshots:
+            size = snapshot_path.stat().st_size
+            if total + size > self.max_bytes:
+                print(f'Snapshot {snapshot_path.name} removed from the cache')
+                snapshot_path.unlink(missing_ok=True)
+            else:
+                total += size
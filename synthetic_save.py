@@ -0,0 +1,273 @@
+import argparse
+import json
+import random
+from pathlib import Path
+
+# Command line generator of fake projected saves, the JSON to_json writes, for benchmarks and for trying the
+# exporter without a game install. Everything comes from a seeded random.Random, so a seed and size always give
+# the same save.
+
+first_names = 400
+trait_count = 300
+title_ranks = 'bbbbccccdddkkex'
+death_reasons = ('death_natural_causes', 'death_battle', 'death_illness', 'death_murder', 'death_old_age')
+
+
+def save_date(rng: random.Random, year: int) -> str:
+    return f'{year}.{rng.randint(1, 12)}.{rng.randint(1, 28)}'
+
+
+def as_value(key: str, ids: list):
+
+    # Children are always a list, but a single spouse or concubinist is written as a plain value
+    return ids[0] if len(ids) == 1 and key != 'child' else list(ids)
+
+
+class SaveGenerator:
+
+    """Builds the five sections char_main reads. Characters are made a generation at a time from a couple per
+    dynasty: children take their father's house, or found a cadet house of it, adults marry into other houses or
+    lowborn families, some remarry or take concubines, and a share of the older generations is pruned from the
+    save while still being referenced by their relatives, as in real late game saves."""
+
+    def __init__(self, characters: int, dynasties: int = None, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.target = characters
+        self.root_count = dynasties or max(1, characters // 400)
+        self.characters = {}
+        self.dynasties = {}
+        self.family = {}
+        self.next_id = 1
+        self.year = 800
+
+    def new_id(self) -> int:
+
+        # Save IDs are increasing but far from contiguous
+        self.next_id += self.rng.randint(1, 8)
+        return self.next_id
+
+    def new_house(self, head: int, parent: int = None) -> int:
+        rng = self.rng
+        house = len(self.dynasties) + 1
+        record = {'head_of_house': head}
+        kind = rng.random()
+        if kind < 0.6:
+            record['name'] = f'dynn_{house}'
+        elif kind < 0.85:
+            record['key'] = f'house_h{house}' if rng.random() < 0.5 else f'dyn_name_{house}'
+        else:
+            record['localized_name'] = f'Local House {house}'
+        if parent is not None:
+            record['parent_dynasty_house'] = parent
+        self.dynasties[str(house)] = record
+        return house
+
+    def new_character(self, house: int = None, female: bool = None, faith: int = None, culture: int = None) -> int:
+        rng = self.rng
+        id_num = self.new_id()
+        person = {
+            'first_name': f'name_{rng.randrange(first_names)}',
+            'birth': save_date(rng, self.year + rng.randint(0, 10)),
+            'skill': [rng.randint(0, 25) for _ in range(6)],
+            'faith': faith if faith is not None else rng.randrange(30),
+            'culture': culture if culture is not None else rng.randrange(40),
+        }
+        if house is not None:
+            person['dynasty_house'] = house
+        if female if female is not None else rng.random() < 0.5:
+            person['female'] = True
+        if rng.random() < 0.7:
+            person['traits'] = rng.sample(range(trait_count), rng.randint(1, 6))
+        if rng.random() < 0.15:
+            person['recessive_traits'] = [rng.randrange(trait_count)]
+        if rng.random() < 0.1:
+            person['sexuality'] = rng.choice(('ho', 'bi', 'as'))
+        self.characters[id_num] = person
+        self.family[id_num] = {}
+        return id_num
+
+    def link(self, first: int, key: str, second: int):
+        self.family[first].setdefault(key, []).append(second)
+
+    def marry(self, husband: int, wife: int, former: bool = False):
+        key = 'former_spouses' if former else 'spouse'
+        self.link(husband, key, wife)
+        self.link(wife, key, husband)
+
+    def spouse_for(self, person: int, pool: list) -> int:
+
+        # Another house's unmarried adult when there is one, otherwise a lowborn
+        rng = self.rng
+        female = not self.characters[person].get('female')
+        for _ in range(4):
+            if pool and rng.random() < 0.7:
+                other = rng.choice(pool)
+                if (bool(self.characters[other].get('female')) == female and other != person
+                        and self.characters[other].get('dynasty_house') != self.characters[person].get('dynasty_house')
+                        and 'spouse' not in self.family[other]):
+                    return other
+        return self.new_character(female=female)
+
+    def children_of(self, father: int, mother: int, house: int) -> list:
+        rng = self.rng
+        children = []
+        for _ in range(rng.choice((0, 1, 1, 2, 2, 2, 3, 3, 4, 5))):
+            child_house = house
+            # Younger sons now and then found a cadet house of their father's house
+            if children and rng.random() < 0.03:
+                child_house = None
+            child = self.new_character(child_house, faith=self.characters[father]['faith'],
+                                       culture=self.characters[father]['culture'])
+            if child_house is None:
+                self.characters[child]['dynasty_house'] = self.new_house(child, parent=house)
+                self.characters[child].pop('female', None)
+            self.link(father, 'child', child)
+            self.link(mother, 'child', child)
+            children.append(child)
+        return children
+
+    def founders(self, count: int) -> list:
+        couples = []
+        for _ in range(count):
+            founder = self.new_character(None, female=False)
+            house = self.new_house(founder)
+            self.characters[founder]['dynasty_house'] = house
+            couples.append((founder, self.new_character(female=True), house))
+        return couples
+
+    def generate(self) -> dict:
+        rng = self.rng
+        couples = self.founders(self.root_count)
+
+        while len(self.characters) < self.target:
+            # Lines that died out are replaced by new dynasties
+            couples = couples or self.founders(self.root_count)
+            self.year += 25
+            adults = []
+            for father, mother, house in couples:
+                adults += self.children_of(father, mother, house)
+                # Concubines are lowborn and their children belong to the father's house
+                if rng.random() < 0.08:
+                    concubine = self.new_character(female=True)
+                    self.link(concubine, 'concubinist', father)
+                    adults += self.children_of(father, concubine, house)
+                if len(self.characters) >= self.target:
+                    break
+
+            couples = []
+            for adult in adults:
+                if len(self.characters) >= self.target or rng.random() < 0.25:
+                    continue
+                spouse = self.spouse_for(adult, adults)
+                female = self.characters[adult].get('female')
+                husband, wife = (spouse, adult) if female else (adult, spouse)
+                if rng.random() < 0.1:
+                    # A first marriage that ended, leaving a former spouse behind
+                    first = self.new_character(female=not female)
+                    self.marry(*((first, adult) if female else (adult, first)), former=True)
+                self.marry(husband, wife)
+                house = self.characters[husband].get('dynasty_house')
+                if house is None or (female and rng.random() < 0.1):
+                    house = self.characters[wife].get('dynasty_house')
+                if house is not None:
+                    couples.append((husband, wife, house))
+
+        return self.finish()
+
+    def finish(self) -> dict:
+        rng = self.rng
+        titles = {str(title): {'key': f'{rng.choice(title_ranks)}_title_{title}', 'name': f'Title {title}'}
+                  for title in range(max(50, self.target // 20))}
+        heads = {record['head_of_house'] for record in self.dynasties.values()}
+
+        # Everyone born more than two generations ago is dead, and the living can hold titles
+        living_year = self.year - 50
+        living, dead = {}, {}
+        for id_num, person in self.characters.items():
+            if self.family[id_num]:
+                person['family_data'] = {key: as_value(key, ids) for key, ids in self.family[id_num].items()}
+            # Lowborns always keep theirs, having no house head to fall back on
+            if id_num not in heads and 'dynasty_house' in person and rng.random() < 0.08:
+                person.pop('faith' if rng.random() < 0.5 else 'culture')
+            if int(person['birth'].split('.')[0]) < living_year:
+                person['dead_data'] = {'date': save_date(rng, int(person['birth'].split('.')[0]) + rng.randint(20, 70)),
+                                       'reason': rng.choice(death_reasons)}
+                if rng.random() < 0.3:
+                    person['dead_data']['domain'] = [rng.randrange(len(titles))]
+                dead[str(id_num)] = person
+            else:
+                if rng.random() < 0.2:
+                    person['landed_data'] = {'domain': [rng.randrange(len(titles)) for _ in range(rng.randint(1, 3))]}
+                living[str(id_num)] = person
+
+        # Pruned characters are gone from the save but still referenced by their relatives
+        for id_num in rng.sample(sorted(dead), len(dead) // 20):
+            if int(id_num) not in heads:
+                del dead[id_num]
+
+        return {
+            'landed_titles': titles,
+            'dynasties': self.dynasties,
+            'characters': {**living, **dead},
+            'religion': {str(faith): {'name': f'faith_{faith}'} if faith % 3 else {'template': f'faith_template_{faith}'}
+                         for faith in range(30)},
+            'culture': {str(culture): {'name': f'culture_{culture}'} for culture in range(40)},
+        }
+
+
+def generate_save(characters: int, dynasties: int = None, seed: int = 0) -> dict:
+    return SaveGenerator(characters, dynasties, seed).generate()
+
+
+def generate_localization(data: dict, seed: int = 0) -> dict:
+
+    """Localization for the keys of a generated save, in the form Load.loading_loc returns. About one key in five
+    is left out on purpose so the fallbacks of the export get exercised."""
+
+    rng = random.Random(seed)
+    keys = [f'name_{name}' for name in range(first_names)]
+    keys += [record['name'] for record in data['dynasties'].values() if 'name' in record]
+    keys += [record['key'] for record in data['landed_titles'].values()]
+    keys += [record.get('name') or record['template'] for record in data['religion'].values()]
+    keys += [record['name'] for record in data['culture'].values()]
+    loc_data = {key: key.replace('_', ' ').title() for key in keys if rng.random() < 0.8}
+    loc_data.update({str(trait): f'Trait {trait}' for trait in range(trait_count - 10)})
+    return loc_data
+
+
+def largest_house_member(data: dict) -> str:
+
+    # The main ID of the biggest export: the head of the root house with the most members across its cadets
+    roots = {}
+    for house, record in data['dynasties'].items():
+        root = house
+        while 'parent_dynasty_house' in data['dynasties'][root]:
+            root = str(data['dynasties'][root]['parent_dynasty_house'])
+        roots[house] = root
+    sizes = {}
+    for person in data['characters'].values():
+        if 'dynasty_house' in person:
+            root = roots[str(person['dynasty_house'])]
+            sizes[root] = sizes.get(root, 0) + 1
+    return str(data['dynasties'][max(sizes, key=sizes.get)]['head_of_house'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Writes a synthetic projected save for benchmarks.')
+    parser.add_argument('json_file', help='JSON file to create')
+    parser.add_argument('-n', '--characters', type=int, default=10000, help='number of characters to generate')
+    parser.add_argument('-d', '--dynasties', type=int, help='number of root dynasties, by default one per 400')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('--localization', metavar='JSON', help='also write matching localization to this file')
+    args = parser.parse_args(argv)
+
+    data = generate_save(args.characters, args.dynasties, args.seed)
+    Path(args.json_file).write_text(json.dumps(data, separators=(',', ':')), encoding='utf-8')
+    print(f'{len(data["characters"])} characters in {len(data["dynasties"])} houses written to {args.json_file}, '
+          f'largest export from main ID {largest_house_member(data)}')
+    if args.localization:
+        Path(args.localization).write_text(json.dumps(generate_localization(data, args.seed)), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
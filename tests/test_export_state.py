@@ -0,0 +1,104 @@
+import contextlib
+import copy
+import gzip
+import io
+import pickle
+import re
+import tempfile
+import unittest
+from pathlib import Path
+import character as chr
+from synthetic_save import generate_localization, generate_save, largest_house_member
+
+
+def later_save(data: dict, main_id: str) -> dict:
+
+    # The save a while later: house members renamed, given traits, dead, married and with a new child, and the house
+    # itself renamed, which changes the rows of its members that did not change themselves
+    data = copy.deepcopy(data)
+    characters = data['characters']
+    house = characters[main_id]['dynasty_house']
+    members = [id_num for id_num, info in characters.items() if info.get('dynasty_house') == house]
+    characters[members[1]]['first_name'] = 'name_0'
+    characters[members[2]].setdefault('traits', []).append(3)
+    characters[members[3]]['dead_data'] = {'date': '1100.1.1', 'reason': 'death_battle'}
+    newborn = str(max(int(id_num) for id_num in characters) + 1)
+    characters[newborn] = {'first_name': 'name_1', 'birth': '1100.1.1', 'skill': [0] * 6, 'faith': 1, 'culture': 1,
+                           'dynasty_house': house}
+    family = characters[members[4]].setdefault('family_data', {})
+    family['child'] = chr.combine_values(family.get('child')) + [int(newborn)]
+    data['dynasties'][str(house)]['name'] = 'renamed_house'
+    return data
+
+
+class IncrementalExportTest(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = Path(folder.name)
+        self.data = generate_save(3000, 4)
+        self.loc_data = generate_localization(self.data)
+        self.main_id = largest_house_member(self.data)
+
+    def export(self, data: dict, name: str, state: bool = True, loc_data: dict = None) -> tuple[bytes, str]:
+
+        # The written people, marriages and families, and what the export printed. Gramps files are compared
+        # uncompressed, since their gzip header holds the file name, and without change times, which reused people
+        # keep from the export that wrote them
+        output = io.StringIO()
+        out_path = self.folder / name
+        with contextlib.redirect_stdout(output):
+            chr.char_main(copy.deepcopy(data), loc_data or self.loc_data, self.main_id, out_path,
+                          state_path=f'{self.folder / "tree"}.state' if state else None)
+        written = out_path.read_bytes()
+        if out_path.suffix == '.gramps':
+            written = re.sub(rb' change="\d+"', b'', gzip.decompress(written))
+        return written, output.getvalue()
+
+    def reused(self, printed: str) -> tuple[int, int]:
+        return tuple(map(int, re.search(r'(\d+)/(\d+) characters reused', printed).groups()))
+
+    def test_incremental_export_matches_fresh_export(self):
+        for suffix in ('.csv', '.gramps'):
+            with self.subTest(suffix):
+                self.export(self.data, f'first{suffix}')
+                changed = later_save(self.data, self.main_id)
+                incremental, printed = self.export(changed, f'incremental{suffix}')
+                fresh, _ = self.export(changed, f'fresh{suffix}', state=False)
+                self.assertEqual(incremental, fresh)
+                reused, exported = self.reused(printed)
+                self.assertGreater(reused, 0)
+                self.assertLess(reused, exported)
+
+    def test_unchanged_export_reuses_everything(self):
+        first, _ = self.export(self.data, 'first.csv')
+        again, printed = self.export(self.data, 'again.csv')
+        self.assertEqual(again, first)
+        reused, exported = self.reused(printed)
+        self.assertEqual(reused, exported)
+
+    def test_changed_localization_exports_everything(self):
+        self.export(self.data, 'first.csv')
+        loc_data = {key: f'{text} II' for key, text in self.loc_data.items()}
+        changed, printed = self.export(self.data, 'changed.csv', loc_data=loc_data)
+        fresh, _ = self.export(self.data, 'fresh.csv', state=False, loc_data=loc_data)
+        self.assertEqual(changed, fresh)
+        self.assertEqual(self.reused(printed)[0], 0)
+
+    def test_other_state_files_export_everything(self):
+        fresh, _ = self.export(self.data, 'fresh.csv', state=False)
+        state_path = self.folder / 'tree.state'
+        header = {'version': chr.ExportState.version, 'format': chr.CsvWriter.__name__}
+        for content in (b'not a pickle', pickle.dumps([1, 2]), pickle.dumps(header),
+                        pickle.dumps({**header, 'characters': {}}),
+                        pickle.dumps({**header, 'characters': [], 'localization': {}})):
+            with self.subTest(content=content[:40]):
+                state_path.write_bytes(content)
+                exported, printed = self.export(self.data, 'exported.csv')
+                self.assertEqual(exported, fresh)
+                self.assertEqual(self.reused(printed)[0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
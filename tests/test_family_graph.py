@@ -0,0 +1,42 @@
+import unittest
+from character import FamilyGraph
+
+
+def family_save(children: dict, spouses: dict) -> dict:
+    ids = set(children) | set(spouses) | {child for kids in children.values() for child in kids}
+    characters = {id_num: {'family_data': {}} for id_num in ids}
+    for parent, kids in children.items():
+        characters[parent]['family_data']['child'] = [int(child) for child in kids]
+    for id_num, spouse in spouses.items():
+        characters[id_num]['family_data']['spouse'] = int(spouse)
+    return {'characters': characters}
+
+
+class RelativesTest(unittest.TestCase):
+
+    def test_generations(self):
+
+        # 1 is the parent of 2, which is the parent of 3, the parent of 4
+        graph = FamilyGraph(family_save({'1': ['2'], '2': ['3'], '3': ['4']}, {}))
+        self.assertEqual([id_num for id_num, _ in graph.relatives('2', 0)], ['2'])
+        self.assertEqual([id_num for id_num, _ in graph.relatives('2', 1)], ['2', '1', '3'])
+        self.assertEqual([id_num for id_num, _ in graph.relatives('2', 2)], ['2', '1', '3', '4'])
+
+    def test_missing_spouses_without_in_laws(self):
+        graph = FamilyGraph(family_save({'1': ['2']}, {'2': '3', '3': '2'}))
+        self.assertEqual([id_num for id_num, _ in graph.relatives('2', 1)], ['2', '1'])
+        self.assertEqual([id_num for id_num, _ in graph.relatives('2', 1, in_laws=1)], ['2', '1', '3'])
+
+    def test_shorter_path_after_spouse_crossing(self):
+
+        # Main character 10 has parent 20 and wife 30. 40 is the parent of 20 and of 30, so the walk reaches it as a
+        # grandparent first, with no generation left, and then as the wife's parent, one generation up. The second
+        # visit must still walk up to 40's parent 50
+        graph = FamilyGraph(family_save({'20': ['10'], '40': ['20', '30'], '50': ['40']}, {'10': '30', '30': '10'}))
+        relatives = [id_num for id_num, _ in graph.relatives('10', 2, in_laws=1)]
+        self.assertEqual(sorted(relatives), ['10', '20', '30', '40', '50'])
+        self.assertEqual([id_num for id_num, _ in graph.relatives('10', 2)], ['10', '20', '40'])
+
+
+if __name__ == '__main__':
+    unittest.main()
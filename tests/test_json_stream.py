@@ -0,0 +1,103 @@
+import contextlib
+import io
+import json
+import random
+import tempfile
+import unittest
+from pathlib import Path
+import loading_text as lt
+import character as chr
+from benchmark import prepare
+from json_stream import JsonStream
+
+# Chunk sizes that cut every token somewhere, and max_record values that force the walk instead of a decode
+chunk_sizes = (1, 3, 7, 64, 1 << 20)
+max_records = (1, 8, 1 << 24)
+
+
+def random_value(rng: random.Random, depth: int = 0):
+    kind = rng.randrange(10 if depth < 4 else 6)
+    if kind == 0:
+        return rng.randint(-10 ** 12, 10 ** 12)
+    if kind == 1:
+        return rng.choice((0.5, -1.25e-7, 3.0e21, 123456.789, -0.0))
+    if kind == 2:
+        return rng.choice((True, False, None))
+    if kind in (3, 4, 5):
+        return ''.join(rng.choice('ab "\\/\n\té€😀,:{}[]') for _ in range(rng.randrange(12)))
+    if kind in (6, 7):
+        return [random_value(rng, depth + 1) for _ in range(rng.randrange(6))]
+    return {str(rng.randrange(10000)): random_value(rng, depth + 1) for _ in range(rng.randrange(6))}
+
+
+def documents() -> list:
+    rng = random.Random(0)
+    fixed = ['{}', '[]', '0', '-12.5e3', '"x"', 'null', ' { "a" : [ 1 , 2 ] , "b" : { } } ', '[1234567890123]']
+    texts = [json.dumps({str(key): random_value(rng) for key in range(20)}) for _ in range(20)]
+    texts += [json.dumps(random_value(rng), indent=rng.choice((None, 2))) for _ in range(20)]
+    return fixed + texts
+
+
+class JsonStreamTest(unittest.TestCase):
+
+    def test_value_matches_json_loads(self):
+        for text in documents():
+            expected = json.loads(text)
+            for chunk_size in chunk_sizes:
+                for max_record in max_records:
+                    stream = JsonStream(io.StringIO(text), chunk_size, max_record)
+                    self.assertEqual(stream.value(), expected, (text, chunk_size, max_record))
+                    self.assertEqual(stream.peek(), '')
+
+    def test_items_with_skip(self):
+
+        # Every other value is skipped, and the values read must still be the right ones
+        for text in documents():
+            expected = json.loads(text)
+            if not isinstance(expected, dict):
+                continue
+            for chunk_size in chunk_sizes:
+                for max_record in max_records:
+                    stream = JsonStream(io.StringIO(text), chunk_size, max_record)
+                    read = {}
+                    for index, key in enumerate(stream.items()):
+                        if index % 2:
+                            stream.skip()
+                        else:
+                            read[key] = stream.value()
+                    self.assertEqual(read, {key: value for index, (key, value) in enumerate(expected.items())
+                                            if not index % 2})
+                    self.assertEqual(stream.peek(), '')
+
+    def test_elements(self):
+        text = json.dumps([{'a': [1, 2.5, 'x']}, [], 7, 'y'])
+        for chunk_size in chunk_sizes:
+            stream = JsonStream(io.StringIO(text), chunk_size, 1)
+            values = [stream.value() for _ in stream.elements()]
+            self.assertEqual(values, json.loads(text))
+
+    def test_invalid_document(self):
+        for text in ('{"a" 1}', '[1 2]', '{"a": [1, }', '{"a": 1'):
+            for chunk_size in chunk_sizes:
+                with self.assertRaises(json.JSONDecodeError):
+                    JsonStream(io.StringIO(text), chunk_size, 8).value()
+
+
+class StreamDataTest(unittest.TestCase):
+
+    def test_streamed_export_matches_full_load(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            workdir = Path(workdir)
+            json_path, main_id = prepare(workdir, 3000, 4, 0)
+            with contextlib.chdir(workdir), contextlib.redirect_stdout(io.StringIO()):
+                for name, stream_id in (('full.csv', None), ('streamed.csv', main_id)):
+                    loader = lt.Load()
+                    data, loc_data = loader.loading_main(json_path, stream_id, snapshot=False)
+                    chr.char_main(data, loc_data, main_id, workdir / name)
+            full = (workdir / 'full.csv').read_bytes()
+            self.assertGreater(full.count(b'\n'), 100)
+            self.assertEqual((workdir / 'streamed.csv').read_bytes(), full)
+
+
+if __name__ == '__main__':
+    unittest.main()
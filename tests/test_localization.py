@@ -0,0 +1,152 @@
+import contextlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+from loading_text import Load, parse_loc_text, parse_trait_definitions
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+sample = '''l_english:
+ # A comment "with quotes"
+ ## Another one: "x"
+ name_aldric:0 "Aldric"
+ name_bera:1 "Bera" # trailing comment "ignored"
+ name_carl: "Carl the #bold Great#! of 10:30"
+ UPPER_KEY:0 "Skipped"
+ dynn_ui:0 "Line\\nbreak, tab\\there, \\x41\\u00e9\\U0001F600 and \\\\ backslash"
+ name_aldric:0 "Aldric II"
+   name_indented:0   "  Spaced  "
+ name_empty:0 ""
+ no_value_line
+'''
+
+traits_sample = '''l_english:
+ trait_brave:0 "Brave"
+ trait_brave_desc:0 "Brave people are brave"
+ trait_brave_character_desc:0 "[CHARACTER.GetName] is brave"
+ trait_education_learning_1:0 "Novice trait_scholar"
+ brave_custom:0 "Not a trait"
+'''
+
+
+def yaml_route(text: str, traits: bool = False) -> dict:
+
+    # The lines corrected into YAML and loaded with PyYAML, as the localization was read before the direct parser
+    cleaned_lines = []
+    for line in (line.strip() for line in text.splitlines()):
+        if '"' in line and line[1] != '#':
+            key, value = line.split('"', 1)
+            if key.isupper():
+                continue
+            value = value.split('"')[0] + '"'
+            value = value.replace('#', '|').replace(':', '-').rstrip() + '\n'
+            cleaned_lines.append(f"{key.split(':', 1)[0]}: \"{value}")
+    if traits:
+        cleaned_lines = [line.replace('trait_', '') for line in cleaned_lines if "_desc:" not in line
+                         and "_character_desc" not in line and 'trait_' in line]
+    return yaml.safe_load(''.join(cleaned_lines)) if cleaned_lines else {}
+
+
+class ParseLocTextTest(unittest.TestCase):
+
+    def test_values(self):
+        loc_data = parse_loc_text(sample)
+        self.assertEqual(loc_data['name_bera'], 'Bera')
+        self.assertEqual(loc_data['name_indented'], '  Spaced  ')
+        self.assertEqual(loc_data['name_empty'], '')
+
+    def test_comments_and_uppercase_keys_are_skipped(self):
+        loc_data = parse_loc_text(sample)
+        self.assertNotIn('UPPER_KEY', loc_data)
+        self.assertFalse([key for key in loc_data if key.startswith('#') or key == 'l_english'])
+
+    def test_later_keys_override(self):
+        self.assertEqual(parse_loc_text(sample)['name_aldric'], 'Aldric II')
+
+    def test_hash_and_colon_are_rewritten(self):
+        self.assertEqual(parse_loc_text(sample)['name_carl'], 'Carl the |bold Great|! of 10-30')
+
+    def test_escapes(self):
+        self.assertEqual(parse_loc_text(sample)['dynn_ui'], 'Line\nbreak, tab\there, Aé\U0001F600 and \\ backslash')
+
+        # Unknown escapes, which YAML refused, are kept as they are
+        self.assertEqual(parse_loc_text(' key:0 "50\\% off"'), {'key': '50\\% off'})
+
+    def test_traits(self):
+        self.assertEqual(parse_loc_text(traits_sample, traits=True),
+                         {'brave': 'Brave', 'education_learning_1': 'Novice scholar'})
+
+    def test_keys_stay_strings(self):
+
+        # YAML read keys like these as numbers and booleans, the lookups of the export use strings
+        self.assertEqual(parse_loc_text(' 123:0 "Trait"\n yes:0 "Yes"'), {'123': 'Trait', 'yes': 'Yes'})
+
+    @unittest.skipIf(yaml is None, 'PyYAML is not installed')
+    def test_matches_yaml_route(self):
+        self.assertEqual(parse_loc_text(sample), yaml_route(sample))
+        self.assertEqual(parse_loc_text(traits_sample, traits=True), yaml_route(traits_sample, traits=True))
+
+
+trait_definitions = '''@pos_compat_high = 30
+brave = {
+	category = personality
+	opposites = { craven }
+	name = trait_brave_name  # comment with a { brace
+	desc = {
+		first_valid = {
+			triggered_desc = { desc = trait_brave_desc }
+		}
+		name = not_a_name
+	}
+}
+craven={ category = personality }
+# disabled = {
+education_learning_1 = {
+	name = {
+		first_valid = { desc = trait_dynamic }
+	}
+	level = 1
+}
+'''
+
+
+class ParseTraitDefinitionsTest(unittest.TestCase):
+
+    def test_definitions_in_order(self):
+        self.assertEqual(parse_trait_definitions(trait_definitions),
+                         [('brave', 'brave_name'), ('craven', 'craven'),
+                          ('education_learning_1', 'education_learning_1')])
+
+    def test_only_top_level_definitions(self):
+
+        # Blocks nested in a definition, and definitions after a one line block, keep their depth
+        text = 'outer = {\n\tinner = {\n\t\tdeep = { }\n\t}\n}\nnext = { a = { b = c } }\nlast = {\n}\n'
+        self.assertEqual([trait for trait, _ in parse_trait_definitions(text)], ['outer', 'next', 'last'])
+
+    def test_trait_table(self):
+
+        # Indexes follow the definitions across the sorted trait files, names come from the localization key, the
+        # trait itself, or the trait name when neither is localized
+        with tempfile.TemporaryDirectory() as ck3_path:
+            traits_folder = Path(ck3_path, 'game/common/traits')
+            loc_folder = Path(ck3_path, 'game/localization/english')
+            traits_folder.mkdir(parents=True)
+            loc_folder.mkdir(parents=True)
+            (traits_folder / '01_dlc.txt').write_text('dlc_trait = {\n}\n', encoding='utf-8')
+            (traits_folder / '00_traits.txt').write_text(trait_definitions, encoding='utf-8-sig')
+            loc_text = ('l_english:\n trait_brave_name:0 "Brave"\n trait_craven:0 "Craven"\n'
+                        ' trait_craven_desc:0 "Scared"\n')
+            (loc_folder / 'traits_l_english.yml').write_text(loc_text, encoding='utf-8-sig')
+            loader = Load()
+            loader.ck3_path = ck3_path
+            with contextlib.redirect_stdout(io.StringIO()):
+                trait_data = loader.loading_traits('english')
+        self.assertEqual(trait_data, {'0': 'Brave', '1': 'Craven', '2': 'Education Learning 1', '3': 'Dlc Trait'})
+
+
+if __name__ == '__main__':
+    unittest.main()
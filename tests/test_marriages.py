@@ -0,0 +1,97 @@
+import contextlib
+import io
+import math
+import random
+import time
+import unittest
+from unittest import mock
+from character import Character, ExportSession
+
+
+def one_house_save(members: int, seed: int = 0) -> dict:
+
+    # A single house whose members all have three spouses and three concubinists from the house, and children with
+    # their first spouse, the worst case for matching marriages against parent pairs
+    rng = random.Random(seed)
+    ids = [str(id_num) for id_num in range(1, members + 1)]
+    men, women = ids[0::2], ids[1::2]
+    characters = {id_num: {'first_name': 'name', 'birth': '1000.1.1', 'skill': [0] * 6, 'faith': 1, 'culture': 1,
+                           'dynasty_house': 1, 'family_data': {}} for id_num in ids}
+    for id_num in women:
+        characters[id_num]['female'] = True
+    for id_num in ids:
+        partners = women if id_num in men else men
+        family = characters[id_num]['family_data']
+        family['spouse'] = [int(partner) for partner in rng.sample(partners, 3)]
+        family['concubinist'] = [int(partner) for partner in rng.sample(partners, 3)]
+    for husband in men:
+        wife = str(characters[husband]['family_data']['spouse'][0])
+        children = [int(child) for child in rng.sample(ids, 2)]
+        for parent in (husband, wife):
+            characters[parent]['family_data'].setdefault('child', []).extend(children)
+    return {'characters': characters, 'dynasties': {'1': {'head_of_house': 1, 'name': 'house'}},
+            'landed_titles': {}, 'religion': {}, 'culture': {}}
+
+
+def list_scan_spouse_no_kids(self, session):
+
+    # spouse_no_kids as it was before parent_pairs and marriage_pairs, scanning the values and rows themselves
+    for spouse in self.spouse:
+        if str(spouse) in session.all_id_num:
+            if (self.sex == 'Female' and {"husband": str(spouse), "wife": self.id_num}
+                    not in session.child_to_parents.values() and [str(spouse), self.id_num]
+                    not in session.marriage_to_csv):
+                session.marriage_to_csv.append([str(spouse), self.id_num])
+            elif (self.sex == 'Male' and {"husband": self.id_num, "wife": str(spouse)}
+                  not in session.child_to_parents.values() and [self.id_num, str(spouse)]
+                  not in session.marriage_to_csv):
+                session.marriage_to_csv.append([self.id_num, str(spouse)])
+
+
+def link(data: dict) -> ExportSession:
+
+    # The family linking steps of export_members, up to the marriage and family rows
+    session = ExportSession(data, {})
+    with contextlib.redirect_stdout(io.StringIO()):
+        history = [Character(id_num, info, session) for id_num, info in data['characters'].items()]
+        for character in history:
+            character.spouse_no_kids(session)
+        session.add_non_dynasty()
+        session.add_marriage_id()
+        session.add_parents_note()
+    return session
+
+
+def link_seconds(data: dict, repeat: int = 3) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        link(data)
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+class MarriageTest(unittest.TestCase):
+
+    def test_rows_match_list_scan(self):
+        data = one_house_save(600)
+        session = link(data)
+        with mock.patch.object(Character, 'spouse_no_kids', list_scan_spouse_no_kids):
+            expected = link(data)
+        self.assertGreater(len(session.marriage_to_csv), 600)
+        self.assertEqual(session.marriage_to_csv, expected.marriage_to_csv)
+        self.assertEqual(session.families_to_csv, expected.families_to_csv)
+
+    def test_linking_scales_linearly(self):
+
+        # Quadratic matching grows 16 times from 1k to 4k members, linear 4 times. An exponent under 1.5 leaves room
+        # for timing noise while failing any list scan
+        small, large = 1000, 4000
+        small_seconds = link_seconds(one_house_save(small))
+        large_seconds = link_seconds(one_house_save(large))
+        exponent = math.log(large_seconds / small_seconds) / math.log(large / small)
+        self.assertLess(exponent, 1.5, f'{small_seconds:.3f} s for {small}, {large_seconds:.3f} s for {large}')
+
+
+if __name__ == '__main__':
+    unittest.main()
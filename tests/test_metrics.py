@@ -0,0 +1,28 @@
+import unittest
+from metrics import StageMetrics
+
+
+class StageMetricsTest(unittest.TestCase):
+
+    def test_nested_stage_paths(self):
+        metrics = StageMetrics()
+        with metrics.stage('char_batch'):
+            with metrics.stage('char_main 1'):
+                with metrics.stage('family linking'):
+                    pass
+                with metrics.stage('localization'):
+                    pass
+        self.assertEqual([(record['stage'], record['depth']) for record in metrics.stages],
+                         [('char_batch', 0), ('char_batch/char_main 1', 1),
+                          ('char_batch/char_main 1/family linking', 2), ('char_batch/char_main 1/localization', 2)])
+
+    def test_failed_stage_is_kept(self):
+        metrics = StageMetrics()
+        with self.assertRaises(ValueError), metrics.stage('loading_main'), metrics.stage('save'):
+            raise ValueError
+        self.assertEqual([(record['stage'], record['completed']) for record in metrics.stages],
+                         [('loading_main', False), ('loading_main/save', False)])
+
+
+if __name__ == '__main__':
+    unittest.main()
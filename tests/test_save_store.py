@@ -0,0 +1,48 @@
+import tempfile
+import unittest
+from pathlib import Path
+from save_store import SaveStore, data_records, write_store
+
+
+def small_save(name: str) -> dict:
+    return {'characters': {'1': {'first_name': name, 'dynasty_house': 5, 'family_data': {'child': [2]}},
+                           '2': {'first_name': 'child', 'dynasty_house': 5}},
+            'dynasties': {'5': {'name': 'house'}}, 'landed_titles': {}, 'religion': {}, 'culture': {}}
+
+
+def failing_records(data: dict):
+    yield from list(data_records(data))[:2]
+    raise OSError('disk full')
+
+
+class WriteStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.store_path = Path(folder.name) / 'save.sqlite'
+
+    def test_store_matches_data(self):
+        write_store(self.store_path, data_records(small_save('first')))
+        with SaveStore(self.store_path) as store:
+            self.assertEqual(store['characters']['1']['first_name'], 'first')
+            self.assertEqual([id_num for id_num, _ in store.house_members([5])], ['1', '2'])
+            self.assertEqual(store.parents('2'), ['1'])
+
+    def test_failed_write_keeps_previous_store(self):
+        write_store(self.store_path, data_records(small_save('first')))
+        with self.assertRaises(OSError):
+            write_store(self.store_path, failing_records(small_save('second')))
+        with SaveStore(self.store_path) as store:
+            self.assertEqual(store['characters']['1']['first_name'], 'first')
+        self.assertEqual([path.name for path in self.store_path.parent.iterdir()], ['save.sqlite'])
+
+    def test_rewrite_replaces_store(self):
+        write_store(self.store_path, data_records(small_save('first')))
+        write_store(self.store_path, data_records(small_save('second')))
+        with SaveStore(self.store_path) as store:
+            self.assertEqual(store['characters']['1']['first_name'], 'second')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from progress import ProgressReporter
+from save_watcher import ConversionQueue, SaveWatcher, default_json_path
+
+
+class DefaultJsonPathTest(unittest.TestCase):
+
+    def test_only_output_suffix_is_replaced(self):
+        folder = Path('out')
+        for output, expected in (('tree.csv', 'tree.json'), ('tree.csv.gz', 'tree.json'),
+                                 ('tree.gramps', 'tree.json'), ('my.tree.csv', 'my.tree.json'),
+                                 ('my.tree.csv.gz', 'my.tree.json'), ('TREE.CSV', 'TREE.json'),
+                                 ('tree', 'tree.json')):
+            self.assertEqual(default_json_path(str(folder / output)), str(folder / expected))
+
+
+class SaveWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = Path(folder.name)
+
+    def write(self, name: str, content: bytes = b'save', mtime_ns: int = None) -> Path:
+        path = self.folder / name
+        path.write_bytes(content)
+        if mtime_ns is not None:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+        return path
+
+    def test_starts_from_newest_existing_save(self):
+        self.write('old.ck3', mtime_ns=1_000_000_000)
+        newest = self.write('new.ck3', mtime_ns=2_000_000_000)
+        watcher = SaveWatcher(self.folder, settle=5)
+        self.assertIsNone(watcher.poll(now=0))
+        self.assertEqual(watcher.poll(now=5), newest)
+        self.assertIsNone(watcher.poll(now=10))
+
+    def test_waits_until_save_settles(self):
+        watcher = SaveWatcher(self.folder, settle=5)
+        save = self.write('autosave.ck3', b'part')
+        self.assertIsNone(watcher.poll(now=0))
+        save.write_bytes(b'part, more')
+        self.assertIsNone(watcher.poll(now=4))
+        self.assertIsNone(watcher.poll(now=8))
+        self.assertEqual(watcher.poll(now=9), save)
+
+        # The same file written again is a new save
+        self.write('autosave.ck3', b'next save, longer')
+        self.assertIsNone(watcher.poll(now=10))
+        self.assertEqual(watcher.poll(now=15), save)
+
+    def test_empty_and_other_files_are_ignored(self):
+        watcher = SaveWatcher(self.folder, settle=0)
+        self.write('empty.ck3', b'')
+        self.write('notes.txt')
+        self.assertIsNone(watcher.poll(now=0))
+        self.assertIsNone(watcher.poll(now=1))
+
+    def test_newest_of_saves_settling_together(self):
+        watcher = SaveWatcher(self.folder, settle=5)
+        self.write('first.ck3', mtime_ns=1_000_000_000)
+        newest = self.write('second.ck3', mtime_ns=2_000_000_000)
+        self.assertIsNone(watcher.poll(now=0))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(watcher.poll(now=5), newest)
+        self.assertIsNone(watcher.poll(now=10))
+
+
+class ConversionQueueTest(unittest.TestCase):
+
+    def test_waiting_save_is_superseded(self):
+        started = threading.Event()
+        release = threading.Event()
+        second_done = threading.Event()
+        converted = []
+
+        def convert(save):
+            started.set()
+            release.wait(5)
+            converted.append(save)
+            if len(converted) == 2:
+                second_done.set()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            queue = ConversionQueue(convert)
+            queue.put(Path('a.ck3'))
+            self.assertTrue(started.wait(5))
+            for name in ('b.ck3', 'c.ck3', 'd.ck3'):
+                queue.put(Path(name))
+            release.set()
+            self.assertTrue(second_done.wait(5))
+            queue.close()
+        self.assertEqual(converted, [Path('a.ck3'), Path('d.ck3')])
+
+    def test_failures_do_not_stop_the_queue(self):
+        failed = []
+        failure_reported = threading.Event()
+        converted = threading.Event()
+
+        def convert(save):
+            if save.name == 'bad.ck3':
+                raise ValueError('bad save')
+            converted.set()
+
+        def on_error(save, error):
+            failed.append((save.name, str(error)))
+            failure_reported.set()
+
+        queue = ConversionQueue(convert, on_error)
+        queue.put(Path('bad.ck3'))
+        self.assertTrue(failure_reported.wait(5))
+        queue.put(Path('good.ck3'))
+        self.assertTrue(converted.wait(5))
+        queue.close()
+        self.assertEqual(failed, [('bad.ck3', 'bad save')])
+
+
+class ReporterTest(unittest.TestCase):
+
+    def test_abort_leaves_failed_stage_unfinished(self):
+        stream = io.StringIO()
+        reporter = ProgressReporter(stream)
+        reporter.enter('to_json')
+        reporter.abort()
+        reporter.enter('to_json')
+        reporter.enter(None)
+        events = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([event['status'] for event in events], ['started', 'started', 'finished'])
+
+
+if __name__ == '__main__':
+    unittest.main()